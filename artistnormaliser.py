@@ -1,6 +1,211 @@
 import re
+import os
+import sys
 from itertools import chain
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+the normalisation engine: everything below is compiled once at import time and shared by
+BaseNormaliser, ArtistNameNormaliser and Artist.normalise_name
+"""
+
+NUMBERS_1TO9 = 'one two three four five six seven eight nine'.split()
+NUMBERS_10TO19 = 'ten eleven twelve thirteen fourteen fifteen sixteen seventeen eighteen nineteen'.split()
+NUMBERS_20TO90 = 'twenty thirty forty fifty sixty seventy eighty ninety'.split()
+
+# Artist.normalise_name has always spelled forty as fourty; keep that so its output doesn't change
+ARTIST_NUMBERS_20TO90 = 'twenty thirty fourty fifty sixty seventy eighty ninety'.split()
+
+def spelledout_numbers_table(numbers_20to90=NUMBERS_20TO90):
+	"""
+	returns an ordered dictionary mapping spelled out numbers between 1 and 99 to numbers in digits;
+	the order is important because we want to search for spelled numbers starting from the compound
+	ones like twenty two, then try to find the rest
+	"""
+	# produce numbers like twenty one, fifty seven, etc.
+	numbers_21to99 = [' '.join([s,p]) for s in numbers_20to90 for p in NUMBERS_1TO9]
+
+	od = OrderedDict(zip(numbers_21to99,
+							# create a list [21,22,..,29,31,..,39,41,..,99]
+							[str(_) for _ in chain.from_iterable(range(d*10 + 1, (d+1)*10) for d in range(2,10))]))
+	od.update(zip(numbers_20to90, [str(_) for _ in range(20,100,10)]))
+	od.update(zip(NUMBERS_10TO19, [str(_) for _ in range(10,20)]))
+	od.update(zip(NUMBERS_1TO9, [str(_) for _ in range(1,10)]))
+
+	return od
+
+def spelledout_numbers_regex(od):
+	"""
+	one alternation regex matching any key of od as a whole word; alternatives keep the order of od
+	so that at any position a compound number wins over its first word - this gives the same result as
+	running a separate re.sub for each key in turn
+	"""
+	return re.compile(r'\b(?:' + '|'.join(re.escape(w_) for w_ in od) + r')\b')
+
+SPELLEDOUT_NUMBERS = spelledout_numbers_table()
+SPELLEDOUT_NUMBERS_RE = spelledout_numbers_regex(SPELLEDOUT_NUMBERS)
+
+ARTIST_SPELLEDOUT_NUMBERS = spelledout_numbers_table(ARTIST_NUMBERS_20TO90)
+ARTIST_SPELLEDOUT_NUMBERS_RE = spelledout_numbers_regex(ARTIST_SPELLEDOUT_NUMBERS)
+
+# separators and quotes become white spaces, brackets are removed
+SEPARATORS = str.maketrans('_-:;/.,"`\'', ' '*10)
+BRACKETS = str.maketrans('', '', '[]{}()')
+
+EMOJI_RE = re.compile(r'\s*:[\(\)]\s*')
+WSP_RE = re.compile(r'\s{2,}')
+# note that inside the character class \b is a backspace, not a word boundary
+EXCLAMATION_INSIDE_RE = re.compile(r'\!+(?=[^\b\w])')
+EXCLAMATION_END_RE = re.compile(r'\!+$')
+THE_A_RE = re.compile(r'^(the|a)\s+')
+
+def spelledout_numbers_to_numbers(s, od=SPELLEDOUT_NUMBERS, regex=SPELLEDOUT_NUMBERS_RE):
+	"""
+	returns string s where all spelled out numbers between 0 and 99 are
+	converted to numbers
+	"""
+	return regex.sub(lambda m: od[m.group()], s)
+
+def normalize_base(s):
+	"""
+	lower case, replace separators and quotes with white spaces, remove all brackets
+	then all spelled numbers to numbers, then and -> &, make all white spaces single and strip
+	"""
+	return WSP_RE.sub(' ', spelledout_numbers_to_numbers(s.lower().translate(SEPARATORS).translate(BRACKETS)).replace(' and ',' & ')).strip()
+
+def normalize_artist_name(name):
+	"""
+	return a normalized artist name; this is what ArtistNameNormaliser.normalize does
+	"""
+	# label emojis, specifically :) and :( as @artist, then apply
+	# base normalization
+	name = normalize_base(EMOJI_RE.sub(' @artist ', name))
+
+	# if now name is ? it may be an artist, so label as @artist
+	if name.strip() in {'?','...'}:
+		return '@artist'
+
+	# fix ! - remove if at the end of a word, otherwise replace with i
+	name = EXCLAMATION_END_RE.sub('', EXCLAMATION_INSIDE_RE.sub('', name)).replace('!','i')
+
+	# remove the and a, then multiple white spaces
+	return WSP_RE.sub(' ', THE_A_RE.sub('', name)).strip()
+
+def normalise_name(name):
+	"""
+	return a normalized artist name; this is what Artist.normalise_name does
+	"""
+	name = name.lower()
+
+	# if its only ? it may be an artist
+	if name.strip() in {'?','...'}:
+		return '@artist'
+
+	# label emojis, then replace separators and quotes with white spaces
+	name = EMOJI_RE.sub(' @artist ', name).translate(SEPARATORS)
+
+	# fix ! - remove if at the end of a word, otherwise replace with i
+	name = EXCLAMATION_END_RE.sub('', EXCLAMATION_INSIDE_RE.sub('', name)).replace('!','i')
+
+	# remove all brackets, the and a and multiple white spaces
+	name = WSP_RE.sub(' ', THE_A_RE.sub('', name.translate(BRACKETS)))
+
+	# spelled numbers to numbers and replace and with &
+	name = spelledout_numbers_to_numbers(name, ARTIST_SPELLEDOUT_NUMBERS, ARTIST_SPELLEDOUT_NUMBERS_RE).replace(' and ',' & ')
+
+	return WSP_RE.sub(' ', name).strip()
+
+def _normalize_chunk(args):
+
+	normaliser, chunk = args
+
+	return [normaliser(s) for s in chunk]
+
+def normalize_many(names, workers=1, chunksize=20000, normaliser=normalize_artist_name):
+	"""
+	return a list of normalized names in the same order as names; repeated names are normalized
+	only once and if workers > 1 (or None - use all cores) chunks of unique names are sent
+	to a process pool; normaliser is a module level function like normalize_artist_name
+	or normalise_name
+	"""
+	names = names if isinstance(names, list) else list(names)
+
+	# dict keeps insertion order so this also fixes the order of chunks
+	uniq = list(dict.fromkeys(names))
+
+	workers = workers or os.cpu_count()
+
+	if (workers > 1) and (len(uniq) > chunksize):
+
+		chunks = ((normaliser, uniq[i:i + chunksize]) for i in range(0, len(uniq), chunksize))
+
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			normalized = dict(zip(uniq, chain.from_iterable(pool.map(_normalize_chunk, chunks))))
+	else:
+		normalized = {n: normaliser(n) for n in uniq}
+
+	return [normalized[n] for n in names]
+
+
+class NormalisationCache:
+	"""
+	bounded LRU cache for normalized names; keeps count of hits, misses and evictions
+	"""
+	def __init__(self, maxsize=100000):
+
+		self.maxsize = maxsize
+		self._cache = OrderedDict()
+		# what the cached strings take, the cache itself is added in stats()
+		self._nbytes = 0
+
+		self.hits = self.misses = self.evictions = 0
+
+	def __len__(self):
+
+		return len(self._cache)
+
+	def get(self, name, normaliser):
+		"""
+		return normaliser(name), normalizing only if name is not in the cache yet
+		"""
+		try:
+			normalized = self._cache[name]
+		except KeyError:
+			pass
+		else:
+			self._cache.move_to_end(name)
+			self.hits += 1
+			return normalized
+
+		self.misses += 1
+
+		normalized = self._cache[name] = normaliser(name)
+		self._nbytes += sys.getsizeof(name) + sys.getsizeof(normalized)
+
+		if len(self._cache) > self.maxsize:
+			name_, normalized_ = self._cache.popitem(last=False)
+			self._nbytes -= sys.getsizeof(name_) + sys.getsizeof(normalized_)
+			self.evictions += 1
+
+		return normalized
+
+	def clear(self):
+
+		self._cache.clear()
+		self._nbytes = 0
+
+	def stats(self):
+		"""
+		returns a dictionary with the cache statistics; memory is in bytes
+		"""
+		lookups = self.hits + self.misses
+
+		return {'size': len(self._cache), 'maxsize': self.maxsize,
+				'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+				'hit_rate': self.hits/lookups if lookups else 0.,
+				'memory': sys.getsizeof(self._cache) + self._nbytes}
+
 
 class BaseNormaliser:
 	"""
@@ -11,84 +216,42 @@ class BaseNormaliser:
 
 	def normalize(self, s):
 
-		# lower case, replace separators and quotes with white spaces, remove all brackets
-		# then all spelled numbers to numbers, then and -> &, make all white spaces single and strip
-
-		return re.sub(r'\s{2,}', ' ', self.spelledout_numbers_to_numbers(re.sub(r'[\[\]\{\}\(\)]','', 
-						re.sub(r'[_\-:;/.,\"\`\']', ' ', s.lower()))).replace(' and ',' & ')).strip()
-
+		return normalize_base(s)
 
 	def spelledout_numbers_to_numbers(self, s):
 		"""
 		returns string s where all spelled out numbers between 0 and 99 are
 		converted to numbers
 		"""
-		numbers_1to9 = 'one two three four five six seven eight nine'.split() 
-		mappings_1to9 = {t[0]: str(t[1]) 
-							   for t in zip(numbers_1to9, range(1,10))}
-		
-		mappings_10to19 = {t[0]: str(t[1]) 
-							   for t in zip("""ten eleven twelve thirteen fourteen fifteen 
-											  sixteen seventeen eighteen nineteen""".split(), range(10,20))}
-		
-		numbers_20to90 = 'twenty thirty forty fifty sixty seventy eighty ninety'.split()
-		mappings_20to90 = {t[0]: str(t[1]) 
-							   for t in zip(numbers_20to90, range(20,100,10))}
-		
-		# produce numbers like twenty one, fifty seven, etc.
-		numbers_21to99 = [' '.join([s,p]) for s in numbers_20to90 for p in numbers_1to9]
-		
-		"""
-		create an ordered dictionary mapping spelled numbers to numbers in
-		digits; note that the order is important because we want to search
-		for spelled numbers starting from the compound ones like twenty two,
-		then try to find the rest
-		"""
-		
-		od = OrderedDict({t[0]:t[1] 
-							for t in zip(numbers_21to99, 
-										 # create a list [21,22,..,29,31,..,39,41,..,99]
-										 [_ for _ in chain.from_iterable([[str(_) for _ in range(int(d)*10 + 1,int(d+1)*10)] 
-											   for d in range(2,10)])])})
-		od.update(mappings_20to90)
-		od.update(mappings_10to19)
-		od.update(mappings_1to9)
-		
-		for w_ in od:
-			  s = re.sub(r'\b' + w_ + r'\b', od[w_], s)
-		
-		return s
+		return spelledout_numbers_to_numbers(s)
 
 
 class ArtistNameNormaliser(BaseNormaliser):
 
-	def __init__(self):
-		pass
-	
+	def __init__(self, cache_size=None):
+		"""
+		if cache_size is given, normalized names are kept in a LRU cache of that size
+		"""
+		self.cache = NormalisationCache(cache_size) if cache_size else None
+
 	def normalize(self, name):
 		"""
 		return a normalized artist name
 		"""
+		if self.cache is None:
+			return normalize_artist_name(name)
 
-		# label emojis, specifically :) and :( as @artist, then apply 
-		# base normalization
-
-		name = super().normalize(re.sub(r'\s*:[\(\)]\s*',' @artist ', name))
-		
-		# if now name is ? it may be an artist, so label as @artist
-		if name.strip() in {'?','...'}:
-			return '@artist'
-		
-		# fix ! - remove if at the end of a word, otherwise replace with i
-		name = re.sub(r'\!+$','', re.sub(r'\!+(?=[^\b\w])','', name)).replace('!','i')
-		
-		# remove the and a
-		name = re.sub(r'^(the|a)\s+','', name)
-		 
-		# remove multiple white spaces
-		name = re.sub(r'\s{2,}', ' ', name).strip()
-		
-		return name
+		return self.cache.get(name, normalize_artist_name)
+
+	def cache_stats(self):
+
+		return self.cache.stats() if self.cache is not None else None
+
+	def normalize_many(self, names, workers=1, chunksize=20000):
+		"""
+		return a list of normalized artist names in the same order as names
+		"""
+		return normalize_many(names, workers, chunksize)
 
 if __name__ == '__main__':
 
@@ -1,21 +1,28 @@
 import json
-import re
-from itertools import chain
-from collections import OrderedDict, defaultdict, Counter
-import requests
-from bs4 import BeautifulSoup
-import xml.etree.ElementTree as et
-import time
+from functools import cached_property
+from itertools import islice
 import sys
 import os
 from pprint import pprint
-import soundcloud
-import spotipy
-import boto3
-import io
 # import bson
-from spotipy.oauth2 import SpotifyClientCredentials
-from birdy.twitter import UserClient
+# API clients (spotipy, birdy) and BeautifulSoup are slow to import so they're imported where needed
+from popularity import load_snapshot, most_popular, keep_most_popular
+from store import read_artists, write_artists, append_artists, ArtistDB
+import discogs
+from spotify import GenreCrawler
+from checkpoint import file_key, names_key
+from songkick import SongkickResolver, GigCrawler, SONGKICK_API
+from fetcher import Fetcher, ResponseCache
+from s3upload import S3Uploader
+from metrics import REGISTRY as metrics
+from record import compact
+from gigs import GigTable
+from social import SocialRefresher, birdy_lookup
+from soundcloud_api import SoundCloudResolver, user_fields
+from refresh import RefreshPlanner, mark
+from profiling import Profiler, run_id_from
+from matching import Reconciler, discogs_names
+from artistnormaliser import normalise_name, normalize_many, NormalisationCache, spelledout_numbers_to_numbers, ARTIST_SPELLEDOUT_NUMBERS, ARTIST_SPELLEDOUT_NUMBERS_RE
 
 class Artist:
 
@@ -28,60 +35,184 @@ class Artist:
 
 	MEDIA = 'facebook twitter youtube wikipedia soundcloud equipboard instagram last.fm'.split()
 
-	def __init__(self, create_new=False, artist_file=None):
+	# the methods that are profiled when profiling is on
+	STAGE_METHODS = ('get_genres', 'get_artists_by_genre', 'normalize_all', 'get_maxvideo_views', 'drop_unpopular',
+						'add_songkick_id', 'add_gigs', 'build_gig_table', 'get_soundcloud', 'refresh_social', 'get_facebook_likes',
+						'get_twitter_followers', 'get_discogs', 'match_discogs', 'merge_enrichment', 'save', 'save_to_db', 'save_to_s3')
+
+	def __init__(self, create_new=False, artist_file=None, workers=1, name_cache_size=None, load=True, db=None, http_cache=None,
+					metrics_port=None, metrics_file=None, compact=False, refresh_policy=None, profile=None, previous=None):
 
 		self.create_new = create_new
+		# how many processes to use when normalizing many names at once; None means all cores
+		self.workers = workers
+		# if name_cache_size is given, normalise_name keeps that many normalized names in a LRU cache
+		self.name_cache = NormalisationCache(name_cache_size) if name_cache_size else None
 		self.ARTIST_FILE = f'{Artist.DATA_DIR}/{artist_file}'
 		self.GENRE_FILE = f'{Artist.DATA_DIR}/genres.txt'
 
-		if not self.create_new:
+		# optional SQLite artist database in the data directory; enrichment stages update it in place
+		self.db = ArtistDB(f'{Artist.DATA_DIR}/{db}', normaliser=self.normalise_name) if db else None
+		# optional on-disk cache of API responses in the data directory so that reruns only fetch what's stale
+		self.http_cache = ResponseCache(f'{Artist.DATA_DIR}/{http_cache}') if http_cache else None
+		self._fetchers = {}
+		self._s3 = None
+		# if compact is True, artists are kept as ArtistRecords rather than dictionaries to save memory
+		self.compact = compact
+		# enrichment stages with refresh=True only fetch artists that are new, failed or older than the policy allows
+		self.planner = RefreshPlanner(refresh_policy)
+		# for a refresh, the file in the data directory a previous run of the stage wrote; whatever it has for an
+		# artist (like when it was fetched from where) is carried over to the artist when artists are loaded
+		self.PREVIOUS_FILE = f'{Artist.DATA_DIR}/{previous}' if previous else None
+
+		# request counts, API latencies and stage progress can be watched at http://localhost:metrics_port/metrics
+		# and/or are written to metrics_file in the data directory every 10 seconds
+		if metrics_port:
+			metrics.serve(metrics_port)
+		if metrics_file:
+			metrics.autodump(f'{Artist.DATA_DIR}/{metrics_file}')
+
+		# with profile (a run id or True) or the ARTISTS_PROFILE environment variable set, every stage method
+		# writes a cProfile dump and its top allocations to data/profiles/<run id>
+		run_id = run_id_from(profile)
+		self.profiler = Profiler(run_id, f'{Artist.DATA_DIR}/profiles') if run_id else None
+
+		if self.profiler:
+			self.profiler.wrap(self, Artist.STAGE_METHODS)
+
+		self._artist_file = artist_file
+
+		if self.create_new:
 
-			self.artists = json.load(open(self.ARTIST_FILE))
-			print(f'loaded {len(self.artists)} artists from {self.ARTIST_FILE}')
+			print('starting from an empty artist list...')
+			self.artists = []
 
-		else:
+		elif not load:
 
-			print('starting from an empty artist list...')
+			# artists will be streamed from the artist file by iter_artists
 			self.artists = []
 
-		self.SONGKICK_API_KEY = json.load(open(f'{Artist.CRED_DIR}/songkick.json'))['songkick_api_key']
+		# otherwise artists are loaded when first needed (see artists below)
+
+		self.DISCOGS_DUMP = f'{Artist.DATA_DIR}/discogs_20180401_artists.xml'
+
+		self.GIGERROR_ARTISTS = []
+
+		# credentials, genres and the popularity reference lists are loaded when first needed too
+
+	@cached_property
+	def artists(self):
+		"""
+		all artists from the artist file (or the database if there's no artist file)
+		"""
+		if (self.db is not None) and (self._artist_file is None):
+			artists = list(self._compacted(self.db))
+			print(f'loaded {len(artists)} artists from {self.db.path}')
+		else:
+			artists = list(self._compacted(self._with_previous(read_artists(self.ARTIST_FILE))))
+			print(f'loaded {len(artists)} artists from {self.ARTIST_FILE}')
+
+		return artists
+
+	def _with_previous(self, artists):
+		"""
+		generator of artists from artists with the fields they don't have taken from the same artist (by id) in
+		the previous file, if any; the fetch records of both are merged
+		"""
+		if not (self.PREVIOUS_FILE and os.path.exists(self.PREVIOUS_FILE)):
+			yield from artists
+			return
+
+		previous = {rc['id']: rc for rc in self._compacted(read_artists(self.PREVIOUS_FILE)) if rc.get('id')}
+
+		print(f'carrying over what we have for {len(previous)} artists from {self.PREVIOUS_FILE}')
+
+		for rc in artists:
+
+			p = previous.pop(rc.get('id'), None)
+
+			if p is not None:
+				fetched = {**(p.get('fetched') or {}), **(rc.get('fetched') or {})}
+				rc.update({k: v for k, v in p.items() if k not in rc})
+				if fetched:
+					rc['fetched'] = fetched
+
+			yield rc
+
+	def _compacted(self, artists):
+
+		return compact(artists) if self.compact else artists
+
+	def _credentials(self, file_):
+		"""
+		returns the credentials from file_ in the credentials directory
+		"""
+		try:
+			return json.load(open(f'{Artist.CRED_DIR}/{file_}'))
+		except FileNotFoundError:
+			raise RuntimeError(f'can\'t read the credentials from {Artist.CRED_DIR}/{file_}!') from None
+
+	@cached_property
+	def SONGKICK_API_KEY(self):
+
+		key_ = self._credentials('songkick.json')['songkick_api_key']
 		print('loaded songkick api key...')
 
-		self.SOUNDCLOUD_API_KEY = json.load(open(f'{Artist.CRED_DIR}/soundcloud.json'))['client_id']
+		return key_
+
+	@cached_property
+	def SOUNDCLOUD_API_KEY(self):
+
+		key_ = self._credentials('soundcloud.json')['client_id']
 		print('loaded soundcloud api key...')
 
-		self.YOUTUBE_DEVELOPER_KEY = json.load(open(f'{Artist.CRED_DIR}/youtube.json'))['developerKey']
+		return key_
+
+	@cached_property
+	def YOUTUBE_DEVELOPER_KEY(self):
+
+		key_ = self._credentials('youtube.json')['developerKey']
 		print('loaded youtube developer key...')
 
-		self.CREDENTIALS_S3 = json.load(open(f'{Artist.CRED_DIR}/s3.json'))
-		
-		self.DISCOGS_DUMP = f'{Artist.DATA_DIR}/discogs_20180401_artists.xml'
+		return key_
 
+	@cached_property
+	def CREDENTIALS_S3(self):
+
+		return self._credentials('s3.json')
+
+	@cached_property
+	def GENRES(self):
+		"""
+		all genres from the genre file; if there's no such file, genres are collected and saved to it
+		"""
 		try:
-			self.GENRES = list({g.strip().lower() for g in open(self.GENRE_FILE).readlines() if g.strip()})
+			genres_ = list({g.strip().lower() for g in open(self.GENRE_FILE).readlines() if g.strip()})
 		except:
-			self.GENRES = self.get_genres()
+			genres_ = self.get_genres()
 			with open(self.GENRE_FILE,'w') as f:
-				for g in self.GENRES:
+				for g in genres_:
 					f.write(f'{g}\n')
 
-		print(f'genres: {len(self.GENRES)}')
+		print(f'genres: {len(genres_)}')
 
-		self.GIGERROR_ARTISTS = []
+		return genres_
 
-		# note that the names of gold/platinum artists get normalized straight away
-		self.goldplatinum = [self.normalise_name(l.strip()) for l in open(f'{Artist.DATA_DIR}/goldplatinum-artists.txt','r').readlines() if l.strip()]
-		self.billboard = [self.normalise_name(l.strip()) for l in open(f'{Artist.DATA_DIR}/billboard_artists.txt','r').readlines() if l.strip()]
-		self.rollingstone = [self.normalise_name(l.strip()) for l in open(f'{Artist.DATA_DIR}/rollingstone.txt','r').readlines() if l.strip()]
-		self.gigs_in_aus = [self.normalise_name(l.strip()) for l in open(f'{Artist.DATA_DIR}/data_atists_aus_gigs.txt','r').readlines() if l.strip()]
-		self.award_winners = {self.normalise_name(a): reward_lst for a, reward_lst in json.load(open(f'{Artist.DATA_DIR}/award_winners.json')).items()}
-		
+	@cached_property
+	def popularity_index(self):
+		"""
+		all popularity reference lists and award winners (with normalized names) in one index; it comes from
+		a snapshot in the data directory that's only rebuilt when a reference file or the normaliser changes
+		"""
+		return load_snapshot(Artist.DATA_DIR, normalise_name, self.normalise_many)
 
 	def get_genres(self, url='http://everynoise.com/everynoise1d.cgi?scope=all'):
 		"""
 		returns a list of all genres from Every Noise at Once
 		"""
-		soup = BeautifulSoup(requests.get(url).text, 'lxml')
+		from bs4 import BeautifulSoup
+
+		soup = BeautifulSoup(self._fetcher('everynoise').get_text(url), 'lxml')
 	
 		genres_ = set()
 	
@@ -91,17 +222,40 @@ class Artist:
 		
 		return list(genres_)
 	
-	def get_artists_by_genre(self, genres_):
+	def _todo(self, source, artists, refresh=False):
+		"""
+		the artists from artists a stage fetching from source has to work on
+		"""
+		return self.planner.plan(artists, source) if refresh else list(artists)
+
+	def _fetcher(self, source):
+		"""
+		returns a blocking HTTP client for source; all of them share the response cache
+		"""
+		if source not in self._fetchers:
+			self._fetchers[source] = Fetcher(source, cache=self.http_cache)
+
+		return self._fetchers[source]
+
+	def get_artists_by_genre(self, genres_, workers=8, rate=10, out_file='artists_genres.jsonl', keep=True):
 		"""
 		returns a dictionary containing artist information;
 		this information is collected via searching by genre, i.e. we count on our list of genres being 
 		comprehensive so having collected artists for each genres we will collect all artist
 
 		input: genres_ is a list of genres
+
+		genres are searched concurrently (workers threads, at most rate requests per second) and new
+		artists are appended to out_file in the data directory as soon as their genre is done; genres
+		already done by an earlier sweep of the same genres into out_file that didn't complete are skipped;
+		if keep is True, new artists are added to self.artists too
 		"""  
 
 		print('searching for artists by genre...')
 
+		import spotipy
+		from spotipy.oauth2 import SpotifyClientCredentials
+
 		try:
 			client_credentials_manager = SpotifyClientCredentials(**json.load(open(f'{Artist.CRED_DIR}/spotify.json')))
 		except:
@@ -109,57 +263,44 @@ class Artist:
 			sys.exit(0)
 	
 		sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-	
-		MX = 4000
-	
-		# keep artist IDs already collected here
-		artist_ids = set()
-	
-		t0 = time.time()
-	
-		for j, g in enumerate(genres_, 1):
-			  
-			print(f'collecting genre {j}/{len(genres_)} - {g}...', end='')
-			  
-			for _ in range(MX//50):
-				  
-				res = sp.search(q='genre:' + g.replace(' ',''), type='artist', limit=50, offset=_*50)
-				  
-				"""
-				response is like this:
-				  
-				{'artists': {'href': 'https://api.spotify.com/v1/search?query=genre%3Apop&type=artist&offset=0&limit=50',
-					   'items': [
-								 {'external_urls': {'spotify': 'https://open.spotify.com/artist/6l3HvQ5sa6mXTsMTB19rO5'},
-								  'followers': {'href': None, 'total': 5054392},
-								  'genres': ['pop', 'pop rap', 'rap'],
-								  'href': 'https://api.spotify.com/v1/artists/6l3HvQ5sa6mXTsMTB19rO5',
-								  'id': '6l3HvQ5sa6mXTsMTB19rO5',  # The Spotify ID for the artist
-								  'images': [{'height': 640,
-											  'url': 'https://i.scdn.co/image/839defbfdeb72488b3b495e2c4e89990933f0167',
-											  'width': 640},
-											 {'height': 320,
-											  'url': 'https://i.scdn.co/image/df0424ed9e3fd02f3c5a98dedd4307adb3df4eb3',
-											  'width': 320},
-											 {'height': 160,
-											  'url': 'https://i.scdn.co/image/6c27976d222131de69da808b86c19c78859c1be0',
-											  'width': 160}],
-								  'name': 'J. Cole',
-								  'popularity': 94,  # between 0 and 100, calculated from the popularity of all the artist’s tracks
-								  'type': 'artist',
-								  'uri': 'spotify:artist:6l3HvQ5sa6mXTsMTB19rO5'  # The **resource** identifier to locate an artist
-								  },
-								  ....
+
+		"""
+		search response is like this:
 				  
-				"""      
-				for a in res['artists']['items']:
-					# note that a is a dictionary with artist information
-					if len(a["name"]) == len(a["name"].encode()):   # don't allow Chinese symbols
-						if a['id'] not in artist_ids:
-							artist_ids.add(a['id'])
-							self.artists.append(a)
+		{'artists': {'href': 'https://api.spotify.com/v1/search?query=genre%3Apop&type=artist&offset=0&limit=50',
+			   'items': [
+						 {'external_urls': {'spotify': 'https://open.spotify.com/artist/6l3HvQ5sa6mXTsMTB19rO5'},
+						  'followers': {'href': None, 'total': 5054392},
+						  'genres': ['pop', 'pop rap', 'rap'],
+						  'href': 'https://api.spotify.com/v1/artists/6l3HvQ5sa6mXTsMTB19rO5',
+						  'id': '6l3HvQ5sa6mXTsMTB19rO5',  # The Spotify ID for the artist
+						  'images': [{'height': 640,
+									  'url': 'https://i.scdn.co/image/839defbfdeb72488b3b495e2c4e89990933f0167',
+									  'width': 640},
+									 {'height': 320,
+									  'url': 'https://i.scdn.co/image/df0424ed9e3fd02f3c5a98dedd4307adb3df4eb3',
+									  'width': 320},
+									 {'height': 160,
+									  'url': 'https://i.scdn.co/image/6c27976d222131de69da808b86c19c78859c1be0',
+									  'width': 160}],
+						  'name': 'J. Cole',
+						  'popularity': 94,  # between 0 and 100, calculated from the popularity of all the artist’s tracks
+						  'type': 'artist',
+						  'uri': 'spotify:artist:6l3HvQ5sa6mXTsMTB19rO5'  # The **resource** identifier to locate an artist
+						  },
+						  ....
 		  
-		print(f'done. collected {len(artist_ids)} artists.' + ' elapsed time: {:.0f} min {:.0f} sec'.format(*divmod(time.time() - t0, 60)))
+		"""      
+
+		# the journal belongs to a sweep of these genres into out_file; once a sweep is complete the next one starts over
+		checkpoint_file = f'{Artist.DATA_DIR}/genres_done_{os.path.basename(out_file).split(".")[0]}_{names_key(genres_)}.txt'
+
+		crawler = GenreCrawler(sp, f'{Artist.DATA_DIR}/{out_file}', checkpoint_file, workers=workers, rate=rate)
+
+		crawler.crawl(genres_, on_artists=self.artists.extend if keep else None)
+
+		if not crawler.failed:
+			os.remove(checkpoint_file)
 		  
 		return self
 
@@ -202,123 +343,96 @@ class Artist:
 
 		all we are interested at this stage is the artist name and Songkick ID
 		"""
-		r = requests.get(f'http://api.songkick.com/api/3.0/search/artists.json?query={name}&apikey={self.SONGKICK_API_KEY}').text 
-
 		try:
-			res = json.loads(r)["resultsPage"]["results"]["artist"][0]  # take the top search result
+			r = self._fetcher('songkick_search').get_json(f'{SONGKICK_API}/search/artists.json', params={'query': name, 'apikey': self.SONGKICK_API_KEY})
+			res = r["resultsPage"]["results"]["artist"][0]  # take the top search result
 		except:
 			return {'name': None, 'id_sk': None}
 
 		return {'name': res['displayName'], 'id_sk': res['id']}
 	
-	def save(self, file_=None):
-	
+	def iter_artists(self, file_=None):
+		"""
+		generator of artists from the artist file (or file_ in the data directory) read one at a time;
+		works for both .jsonl(.gz) files and old single JSON list files
+		"""
+		return read_artists(self.ARTIST_FILE if not file_ else f'{Artist.DATA_DIR}/{file_}')
+
+	def save(self, file_=None, artists=None):
+		"""
+		write self.artists or any iterable of artists to the artist file (or file_ in the data directory);
+		artists are written one by one, as lines if the file name ends with .jsonl or .jsonl.gz
+		"""
 		if not os.path.exists(Artist.DATA_DIR):
 
 		  os.mkdir(Artist.DATA_DIR)
 	
-		if self.artists:
+		if artists is None:
 
-		  json.dump(self.artists, open(self.ARTIST_FILE if not file_ else f'{Artist.DATA_DIR}/{file_}','w'))
+			if not self.artists:
+				print('didn\'t save artists because artist list is empty!')
+				return
 
-		else:
+			artists = self.artists
 
-		  print('didn\'t save artists because artist list is empty!')
+		write_artists(self.ARTIST_FILE if not file_ else f'{Artist.DATA_DIR}/{file_}', artists)
 	
+	def save_to_db(self, artists=None):
+		"""
+		insert or replace self.artists (or any iterable of artists) in the artist database
+		"""
+		n = self.db.upsert_many(self.artists if artists is None else artists)
+
+		print(f'saved {n} artists to {self.db.path}')
+
+		return self
+
+	def find_artist(self, name=None, normalized=False, **ids):
+		"""
+		look up artists in the artist database by name (pass normalized=True if it's already normalized) or
+		by one source id, e.g. find_artist(id_sk=324967)
+		"""
+		if name:
+			return self.db.find_by_name(name, normalized)
+
+		(field, id_), = ids.items()
+
+		return self.db.get(id_) if field == 'id' else self.db.find_by_id(field, id_)
+
+	def _update_db(self, updates):
+		"""
+		if there's an artist database, merge updates (pairs like (artist id, {field: value})) into it
+		"""
+		if self.db is not None:
+			self.db.update_many(updates)
+
 	def spelledout_numbers_to_numbers(self, s):
 		"""
 		returns string s where all spelled out numbers between 0 and 99 are
 		converted to numbers
 		"""
-		numbers_1to9 = 'one two three four five six seven eight nine'.split() 
-		mappings_1to9 = {t[0]: str(t[1]) 
-							   for t in zip(numbers_1to9, range(1,10))}
-		
-		mappings_10to19 = {t[0]: str(t[1]) 
-							   for t in zip("""ten eleven twelve thirteen fourteen fifteen 
-											  sixteen seventeen eighteen nineteen""".split(), range(10,20))}
-		
-		numbers_20to90 = 'twenty thirty fourty fifty sixty seventy eighty ninety'.split()
-		mappings_20to90 = {t[0]: str(t[1]) 
-							   for t in zip(numbers_20to90, range(20,100,10))}
-		
-		# produce numbers like twenty one, fifty seven, etc.
-		numbers_21to99 = [' '.join([s,p]) for s in numbers_20to90 for p in numbers_1to9]
-		
-		"""
-		create an ordered dictionary mapping spelled numbers to numbers in
-		digits; note that the order is important because we want to search
-		for spelled numbers starting from the compound ones like twenty two,
-		then try to find the rest
-		"""
-		
-		od = OrderedDict({t[0]:t[1] 
-							for t in zip(numbers_21to99, 
-										 # create a list [21,22,..,29,31,..,39,41,..,99]
-										 [_ for _ in chain.from_iterable([[str(_) for _ in range(int(d)*10 + 1,int(d+1)*10)] 
-											   for d in range(2,10)])])})
-		od.update(mappings_20to90)
-		od.update(mappings_10to19)
-		od.update(mappings_1to9)
-		
-		for w_ in od:
-			  s = re.sub(r'\b' + w_ + r'\b', od[w_], s)
-		
-		return s
+		return spelledout_numbers_to_numbers(s, ARTIST_SPELLEDOUT_NUMBERS, ARTIST_SPELLEDOUT_NUMBERS_RE)
 	
 	def normalise_name(self, name):
 		"""
-		return a normalized artist name
+		return a normalized artist name; see artistnormaliser.normalise_name
 		"""
-	
-		name = name.lower()
-		
-		# \s matches any whitespace character; 
-		# this is equivalent to the class [ \t\n\r\f\v]
-		wsp = re.compile(r'\s{2,}')
-	
-		emoji = ':) :('.split()
-		
-		# if its only ? it may be an artist
-		if name.strip() in {'?','...'}:
-			return '@artist'
-		
-		# label emojis
-		name = re.sub(r'\s*:[\(\)]\s*',' @artist ', name)
-		
-		# replace separators and quotes with white spaces
-		name = re.sub(r'[_\-:;/.,\"\`\']', ' ', name) 
-		
-		# fix ! - remove if at the end of a word, otherwise replace with i
-		name = re.sub(r'\!+(?=[^\b\w])','', name)
-		name = re.sub(r'\!+$','', name)
-		
-		name = name.replace('!','i')
-		
-		# remove all brackets and hyphens
-		name = re.sub(r'[\[\]\{\}\(\)]','', name) 
-		
-		# remove the and a
-		name = re.sub(r'^(the|a)\s+','', name)
+		if self.name_cache is None:
+			return normalise_name(name)
 
-		# remove multiple white spaces
-		name = wsp.sub(' ',name)
-	
-		# spelled numbers to numbers
-		name = self.spelledout_numbers_to_numbers(name)
-		
-		# replace and with &
-		name = name.replace(' and ',' & ')
-		 
-		# remove multiple white spaces
-		name = wsp.sub(' ',name)
-		
-		# finally, strip
-		name = name.strip()
-		
-		return name
+		return self.name_cache.get(name, normalise_name)
 
-	def normalize_all(self):
+	def name_cache_stats(self):
+
+		return self.name_cache.stats() if self.name_cache is not None else None
+
+	def normalise_many(self, names, workers=None):
+		"""
+		return a list of normalized names in the same order as names; see artistnormaliser.normalize_many
+		"""
+		return normalize_many(names, workers=workers or self.workers, normaliser=normalise_name)
+
+	def normalize_all(self, workers=None):
 		"""
 		normalize all artist names we can find in self.artists
 		"""
@@ -326,8 +440,8 @@ class Artist:
 			print('the artist list is empty!')
 			raise AssertionError
 
-		for rc in self.artists:
-			rc['name'] = self.normalise_name(rc['name'])
+		for rc, name_ in zip(self.artists, self.normalise_many([rc['name'] for rc in self.artists], workers)):
+			rc['name'] = name_
 
 		return self
 
@@ -379,67 +493,62 @@ class Artist:
 				for k in res1["items"]:
 					print(k['statistics'])
 
-	def drop_unpopular(self, local=True):
+	def drop_unpopular(self, local=True, normalize=False, workers=None):
 		"""
 		following normalization, some artists in self.artists may suddenly have the same name; to disambiguate we 
 		simply keep the most popular artist;
 
-		also, drop artists whose popularity is zero
+		also, drop artists whose popularity is zero; if normalize is True, normalize the names first;
+		with local=True artists are streamed from the artist file rather than taken from self.artists
 		"""
 		print('dropping unpopular artists...')
 
-		if local:
-			self.artists = json.load(open(self.ARTIST_FILE))
-			print(f'working with local artist file ({len(self.artists)} artists)...')
-
-		art_before = len(self.artists)
-
-		self.artists = [rc for rc in self.artists if rc['popularity'] > 0]
+		stats_ = {}
 
-		art_after = len(self.artists)
-
-		print(f'removed {art_after - art_before} artists...')
-
-		names_ambig = {k: v for k, v in Counter([rc['name'] for rc in self.artists]).items() if v > 1}
-
-		print(f'found {len(names_ambig)} ambiguous artist names...')
-
-		name_ids_keep = {}
-
-		for rc in self.artists:
-
-			name_ = rc['name']
+		if not local:
+			if normalize:
+				self.artists = list(self._normalized(self.artists, workers))
+			self.artists = list(keep_most_popular(self.artists, stats_))
+		elif normalize:
+			# the file is read twice: names are normalized to find the artists to keep and then for just those
+			keep = most_popular(self._normalized(self._compacted(self.iter_artists()), workers), stats_)
+			self.artists = list(self._normalized((rc for i, rc in enumerate(self._compacted(self.iter_artists())) if keep[i]), workers))
+		else:
+			self.artists = list(keep_most_popular(lambda: self._compacted(self.iter_artists()), stats_))
 
-			if name_ in names_ambig:
+		print(f'removed {stats_["unpopular"]} artists with zero popularity...')
+		print(f'found {stats_["ambiguous_names"]} ambiguous artist names, removed {stats_["duplicates"]} less popular artists...')
 
-				if name_ not in name_ids_keep:
-					name_ids_keep.update({name_: {'id': rc['id'], 
-													'popularity': rc['popularity']}})
-				else:
-					if name_ids_keep[name_]['popularity'] < rc['popularity']:
-						name_ids_keep.update({name_: {'id': rc['id'], 
-														'popularity': rc['popularity']}})
+		if self.db is not None:
+			ids_kept = {rc['id'] for rc in self.artists}
+			self.db.delete_many([id_ for id_ in self.db.ids() if id_ not in ids_kept])
 
-		dic_ = []
+		print(f'now have {len(self.artists)} artists')
 
-		for rc in self.artists:
+		return self
 
-			if rc['name'] in name_ids_keep:  # name is ambiguous
+	def _normalized(self, artists, workers=None, chunksize=100000):
+		"""
+		generator of artists with normalized names; names are normalized chunksize artists at a time
+		"""
+		artists = iter(artists)
 
-				if rc['id'] == name_ids_keep[rc['name']]['id']:
-					dic_.append(rc)
-			else:
-				dic_.append(rc)
+		while True:
 
-		self.artists = dic_
+			chunk = list(islice(artists, chunksize))
 
-		print(f'now have {len(self.artists)} artists')
+			if not chunk:
+				return
 
-		return self
+			for rc, name_ in zip(chunk, self.normalise_many([rc['name'] for rc in chunk], workers)):
+				rc['name'] = name_
+				yield rc
 
-	def add_songkick_id(self):
+	def add_songkick_id(self, concurrency=10, rate=5, refresh=False):
 		"""
-		for every artist from self.artists try to find a Songkick id
+		for every artist from self.artists try to find a Songkick id; names are searched concurrently
+		by at most concurrency workers making no more than rate requests per second; with refresh=True
+		only artists due for a refresh are searched
 		"""
 
 		print('searching for songkick ids...')
@@ -447,38 +556,38 @@ class Artist:
 		match_ = []
 		nomatch_ = []
 
-		t0 = time.time()
+		todo = self._todo('songkick', self.artists, refresh)
 
-		for i, rc in enumerate(self.artists, 1):
-
-			name_ = rc['name']
+		sk_arts = SongkickResolver(self.SONGKICK_API_KEY, concurrency=concurrency, rate=rate, cache=self.http_cache).resolve_many([rc['name'] for rc in todo])
 
-			# search on Songkick by name
-			sk_art = self.get_artist_from_songkick(name_)
+		for rc, sk_art in zip(todo, sk_arts):
 
-			if sk_art['name']:
+			name_ = rc['name']
+			mark(rc, 'songkick', ok='error' not in sk_art)
 
-				if self.normalise_name(sk_art['name']) == name_:
-					rc.update({'id_sk': sk_art['id_sk']})
-					match_.append(name_)
-				else:
-					nomatch_.append(name_)
+			if sk_art['name'] and (self.normalise_name(sk_art['name']) == name_):
+				rc.update({'id_sk': sk_art['id_sk']})
+				match_.append(name_)
 			else:
 				nomatch_.append(name_)
 
-			if i%100 == 0:
+		metrics.inc('matches', 'songkick_search', len(match_))
+		metrics.inc('misses', 'songkick_search', len(nomatch_))
 
-				print(f'{i}/{len(self.artists)} ({100*i/len(self.artists):.2f}%) artists processed...')
-				print(f'matched {len(match_)}, didn\'t match {len(nomatch_)}')
-				print(f'time: {time.time() - t0:.0f} sec / 100')
+		self._update_db((rc['id'], {f: rc[f] for f in ('id_sk', 'fetched') if f in rc}) for rc in todo)
 
-				t0 = time.time()
+		print(f'matched {len(match_)}, didn\'t match {len(nomatch_)}')
 
 		return self
 
-	def add_gigs(self):
+	def add_gigs(self, concurrency=10, rate=5, batch_size=5000, out_file=None, refresh=False):
 		"""
-		add gigography from Songkick; the response look like this:
+		add gigography from Songkick, all pages of it; every batch_size finished artists are dumped to s3
+		and recorded in a checkpoint journal for this crawl, so a crawl that crashed resumes where it stopped
+		(with the gigs found before put back); if out_file (.jsonl or .jsonl.gz in the data directory) is
+		given, finished batches are also appended to it and their gigs aren't kept in memory; with
+		refresh=True only artists due for a refresh are crawled.
+		the response look like this:
 
 		{
 			"resultsPage": {
@@ -552,53 +661,95 @@ class Artist:
 		  "ageRestriction": null
 		}, 
 		"""
+		input_ = 'artists_sk.json'
+
 		try:
-			self.artists = json.load(open(f'{Artist.DATA_DIR}/artists_sk.json'))[54999:]
+			self.artists = list(self._compacted(self._with_previous(self.iter_artists(input_))))
 			print(f'working with {len(self.artists)} artists')
 		except:
 			print('no file found')
 			sys.exit(0)
 
-		dump_count = 11
+		# the journal belongs to a crawl of this very input (and of artists due for a refresh or of all of them);
+		# unless they go to out_file, the gigs of the artists in it are kept next to it so that a resumed crawl
+		# can put them back
+		key_ = file_key(f'{Artist.DATA_DIR}/{input_}')
+		crawl_ = f'{Artist.DATA_DIR}/gigs_done_{"refresh_" if refresh else ""}{key_}'
+		checkpoint_file = f'{crawl_}.txt'
+		done_file = f'{crawl_}.jsonl'
+
+		def _dump(batch, n):
+			# uploads happen in the background while we carry on crawling; the uploader gets its own
+			# copies of the records so that dropping their gigs below doesn't affect it
+			for rc in batch:
+				mark(rc, 'gigs')
+			self.save_to_s3([dict(rc) for rc in batch], f'artdump_{n}.json', wait=False)
+			print(f'dump #{n} ({len(batch)} artists)')
+			self._update_db((rc['id'], {f: rc[f] for f in ('gigs', 'fetched') if f in rc}) for rc in batch)
+			if out_file:
+				append_artists(f'{Artist.DATA_DIR}/{out_file}', batch)
+				for rc in batch:
+					rc.pop('gigs', None)
+			else:
+				append_artists(done_file, ({f: rc[f] for f in ('id_sk', 'gigs', 'fetched') if f in rc} for rc in batch))
 
-		for i, rc in enumerate(self.artists, 1):
+		todo = self._todo('gigs', [rc for rc in self.artists if rc.get('id_sk')], refresh)
 
-			n_ = rc.get('name', None)
+		# artists already in the checkpoint journal are skipped by the crawler so put back what it found for them
+		if os.path.exists(done_file) and not out_file:
 
-			id_sk = rc.get('id_sk', None)
+			done = {d['id_sk']: d for d in read_artists(done_file)}
 
-			if n_.strip() and id_sk:
+			for rc in todo:
+				if rc['id_sk'] in done:
+					rc.update({f: v for f, v in done[rc['id_sk']].items() if f != 'id_sk'})
 
-				print(f'{n_}...')
+			print(f'resuming a crawl, put back gigs of {len(done)} artists')
 
-				try:
-					r = json.loads(requests.get(f'http://api.songkick.com/api/3.0/artists/{id_sk}/gigography.json?apikey={self.SONGKICK_API_KEY}').text)
-	
-					if 'resultsPage' in r:
-						if 'results' in r['resultsPage']:
-							if 'event' in r['resultsPage']['results']:
-								rc.update({'gigs': r['resultsPage']['results']['event']})
-				except:
-					self.GIGERROR_ARTISTS.append({'name': n_, 'id_sk': id_sk})
-					print('can\'t get this artist\'s gigs!')
-					continue
+		crawler = GigCrawler(self.SONGKICK_API_KEY, checkpoint_file=checkpoint_file,
+								retry_file=f'{Artist.DATA_DIR}/gigs_failed.json', concurrency=concurrency, rate=rate, batch_size=batch_size, cache=self.http_cache)
 
-			if i%300 == 0:
-				print(f'{i}/{len(self.artists)} ({100*i/len(self.artists):.2f}%) artists processed...')
+		self.GIGERROR_ARTISTS = crawler.run(todo, on_batch=_dump)
 
-			if i%5000 == 0:
-				
-				from_ = i - 5000
-				to_ = i
+		failed_ids = {a['id_sk'] for a in self.GIGERROR_ARTISTS}
+		failed_ = [rc for rc in todo if rc['id_sk'] in failed_ids]
 
-				dump_count += 1
+		for rc in failed_:
+			mark(rc, 'gigs', ok=False)
 
-				# json.dump(self.artists[from_:to_], open(f'artdump_{dump_count}.json','w'))
-				self.save_to_s3(self.artists[from_:to_], f'artdump_{dump_count}.json')
+		self._update_db((rc['id'], {'fetched': rc['fetched']}) for rc in failed_)
 
-				print(f'dump #{dump_count}')
+		for file_, e in self.s3.join():
+			print(f'upload of {file_} failed: {e}')
 
-		json.dump(self.GIGERROR_ARTISTS, open(f'gigs_failed_.json','w'))
+		# the crawl is complete so the next one starts from scratch
+		for f in (checkpoint_file, done_file):
+			if os.path.exists(f):
+				os.remove(f)
+
+		return self
+
+	def build_gig_table(self, file_=None, out_dir='gigs', aus_file='data_atists_aus_gigs.txt'):
+		"""
+		flatten the gigographies added by add_gigs (of self.artists or of the artists in file_ in the data directory,
+		read one at a time) into a columnar table saved to out_dir in the data directory; if aus_file is given,
+		the names of all artists with gigs in Australia are written to it as that's where the gigs_in_aus
+		popularity flag comes from
+		"""
+		self.gig_table = GigTable.from_artists(self.iter_artists(file_) if file_ else self.artists)
+		self.gig_table.save(f'{Artist.DATA_DIR}/{out_dir}')
+
+		print(f'saved {len(self.gig_table)} gigs of {len(self.gig_table.artist_ids)} artists to {out_dir}')
+
+		if aus_file:
+
+			names_ = sorted(n for n in self.gig_table.artists_with_gigs_in('Australia') if n)
+
+			with open(f'{Artist.DATA_DIR}/{aus_file}', 'w') as f:
+				for n in names_:
+					f.write(f'{n}\n')
+
+			print(f'{len(names_)} artists had gigs in australia')
 
 		return self
 
@@ -609,8 +760,6 @@ class Artist:
 		if not artist_name:
 			raise ValueError(f'you forgot to provide an artist\'s name!')
 
-		inf_ = defaultdict()
-
 		"""
 		check if the artist
 
@@ -619,11 +768,7 @@ class Artist:
 			- is known to have had gigs in Australia (according to Songkick) or
 			- received some awards (in that case, add award names)
 		"""
-		inf_['is_goldplatinum'] = 'y' if artist_name in self.goldplatinum else 'n'
-		inf_['is_billboard'] = 'y' if artist_name in self.billboard else 'n'
-		inf_['is_rollingstone'] = 'y' if artist_name in self.rollingstone else 'n'
-		inf_['gigs_in_aus'] = 'y' if artist_name in self.gigs_in_aus else 'n'
-		inf_['awards'] = self.award_winners[artist_name] if artist_name in self.award_winners else None
+		inf_ = self.popularity_index.lookup(artist_name)
 
 		# rc.update({'is_goldplatinum': 'y' if n_ in self.goldplatinum else 'n'})
 		# rc.update({'is_billboard': 'y' if n_ in self.billboard else 'n'})
@@ -648,9 +793,21 @@ class Artist:
 
 		return inf_
 
-	def get_soundcloud(self):
+	def popularity_many(self, names=None):
+		"""
+		gather popularity measures for many artists in one pass; if names aren't given, do it
+		for all artists in self.artists
 		"""
-		collect information from Soundcloud; a sample of what's available:
+		if names is None:
+			names = (rc['name'] for rc in self.artists)
+
+		return self.popularity_index.lookup_many(names)
+
+	def get_soundcloud(self, concurrency=10, rate=10, top=5, refresh=False):
+		"""
+		collect information from Soundcloud for all artists concurrently (no more than concurrency requests at a time
+		and rate per second); artists with a SoundCloud id are looked up directly, others are searched for and matched
+		against the top results; with refresh=True only artists due for a refresh are looked up; a sample of what's available:
 
 		{'avatar_url': 'https://i1.sndcdn.com/avatars-000277022323-bbsjso-large.jpg',
 			'city': 'Kassel',
@@ -687,160 +844,149 @@ class Artist:
 			'website_title': 'International Website'}
 
 		"""
-		client = soundcloud.Client(client_id=self.SOUNDCLOUD_API_KEY)
+		todo = self._todo('soundcloud', self.artists, refresh)
 
-		for i, rc in enumerate(self.artists, 1):
+		resolver = SoundCloudResolver(self.SOUNDCLOUD_API_KEY, concurrency=concurrency, rate=rate, top=top, cache=self.http_cache,
+										normaliser=self.normalise_name)
 
-			name_ = rc['name']
+		for rc, user in zip(todo, resolver.resolve_many(todo)):
 
-			try:
-				res = client.get('/users', q=name_)[0]
-			except:
-				print(f'couldn\'t find {name_}...')
+			if isinstance(user, Exception):
+				mark(rc, 'soundcloud', ok=False)
+				print(f'couldn\'t look up {rc["name"]}: {user}')
 				continue
 
-			avail_fields = set(res.fields())
-			
-			for c in 'full_name username'.split():
-
-				if (c in avail_fields) and (self.normalise_name(getattr(res, c)) == name_):
-
-					for field_orig, field_new in zip('country city followers_count id permalink_url website'.split(),
-														'country city followers_soundcloud id_sc url_sc website'.split()):
-						if field_orig in avail_fields:
-							_ = getattr(res, field_orig)
-							if isinstance(_, int):
-								rc.update({field_new: _})
-							elif isinstance(_, str) and (len(_) > 1):
-								rc.update({field_new: _.lower()})
-					break
+			mark(rc, 'soundcloud')
+
+			if user is None:
+				metrics.inc('misses', 'soundcloud')
 			else:
-				print('name doesn\'t match..')
+				rc.update(user_fields(user))
+				metrics.inc('matches', 'soundcloud')
+
+		self._update_db((rc['id'], {f: rc[f] for f in 'country city followers_soundcloud id_sc url_sc website fetched'.split() if f in rc})
+							for rc in todo)
 
 		return self
 
-	def save_to_s3(self, what, s3file_):
+	def save_to_s3(self, what, s3file_, wait=True):
 		"""
-		send file_ to an s3 bucket
+		send what to an s3 bucket as gzipped JSON; with wait=False the upload goes to a background
+		queue and this returns straight away (call self.s3.join() to wait for all uploads)
 		"""
-		s3 = boto3.client('s3', **self.CREDENTIALS_S3)
+		self.s3.put(what, s3file_)
 
-		s3.upload_fileobj(Fileobj=io.BytesIO(json.dumps(what).encode()), Bucket='tega-uploads', Key=f'Igor/temp/gigographies/{s3file_}')
+		if wait:
+			self.s3.join()
 
-		
 		return self
 
-	def get_facebook_likes(self):
+	@property
+	def s3(self):
 		"""
-		how many likes an artist has at this time
+		background uploader with one s3 client shared by all uploads
+		"""
+		if self._s3 is None:
+			self._s3 = S3Uploader(self.CREDENTIALS_S3)
+
+		return self._s3
+
+	def refresh_social(self, facebook=True, twitter=True, concurrency=20, per_host=4, refresh=False):
+		"""
+		add Facebook likes and Twitter followers to the artists with Facebook and Twitter links; Facebook pages are
+		fetched concurrently (no more than per_host at a time from the same host) and Twitter users are looked up
+		100 at a time; with refresh=True only artists due for a refresh are fetched
 		"""
-		for i, rc in enumerate(self.artists, 1):
-
-			med = rc.get('media', None)
-			if med:
-				fb = rc['media'].get('facebook', None)
-				if fb:
-					try:
-						fb_soup = BeautifulSoup(requests.get(fb).text, "lxml")
-						likes_ = int(fb_soup.find("span", id="PagesLikesCountDOMID").text.strip().split()[0].replace(',',''))
-						rc.update({'facebook_likes': likes_})
-					except:
-						print(f'can\'t get likes from {fb}!')
+		fb_ = self._todo('facebook', [rc for rc in self.artists if (rc.get('media') or {}).get('facebook')], refresh) if facebook else []
+		tw_ = self._todo('twitter', [rc for rc in self.artists if (rc.get('media') or {}).get('twitter')], refresh) if twitter else []
+
+		lookup = birdy_lookup(self._credentials('twitter.json')) if tw_ else None
+
+		SocialRefresher(lookup, concurrency=concurrency, per_host=per_host, cache=self.http_cache).refresh(fb_, tw_)
+
+		self._update_db((rc['id'], {f: rc[f] for f in ('facebook_likes', 'twitter_followers', 'fetched') if f in rc})
+							for rc in {id(rc): rc for rc in fb_ + tw_}.values())
+
 		return self
 
-	def get_twitter_followers(self):
+	def get_facebook_likes(self, refresh=False):
+		"""
+		how many likes an artist has at this time
+		"""
+		return self.refresh_social(twitter=False, refresh=refresh)
+
+	def get_twitter_followers(self, refresh=False):
 		"""
 		how many Twitter followers an artist has right now
 		"""
-		client = UserClient(**json.load(open(f'{Artist.CRED_DIR}/twitter.json')))
+		return self.refresh_social(facebook=False, refresh=refresh)
 
-		for i, rc in enumerate(self.artists, 1):
+	def get_discogs(self, out_file='discogs_.jsonl', workers=1):
+		"""
+		collect artists with media links from the Discogs dump; the dump is parsed incrementally and
+		artists are written to out_file in the data directory one by one; with workers > 1 the dump is
+		split into parts parsed on multiple cores (out_file must be a .jsonl or .jsonl.gz file then)
+		"""
+		n = discogs.ingest(self.DISCOGS_DUMP, f'{Artist.DATA_DIR}/{out_file}', Artist.MEDIA, workers=workers)
 
-			med = rc.get('media', None)
-			if med:
-				tw = rc['media'].get('twitter', None)
-				if tw:
-					try:
-						tw_followers_ = client.api.users.show.get(screen_name=tw).data['followers_count']
-						rc.update({'twitter_followers': tw_followers_})
-					except:
-						print(f'can\'t get followers from {tw}!')
+		print(f'saved {n} discogs artists to {out_file}')
 
 		return self
 
 
-	def get_discogs(self):
+	def match_discogs(self, file_='discogs_.jsonl', threshold=0.85):
+		"""
+		fuzzy-match the Discogs artists collected by get_discogs to self.artists; a Discogs artist may be
+		found under its name, name variations or aliases; every artist gets the Discogs id and media of
+		its best match (if the similarity is at least threshold)
+		"""
+		reconciler = Reconciler(((i, [rc['name']]) for i, rc in enumerate(self.artists)), normaliser=self.normalise_name, threshold=threshold)
 
-		def __find(element, child_name):
-		
-			try:
-				child = element.find(child_name).text.lower().strip()
-			except:
-				child = None
-			return child
-		
-		def __find_kids(element, child_name, grandchild_name):
-		
-			try:
-				child = element.find(child_name)
-			except:
-				# if there's no child not much sense to proceed
-				return None
-		
-			if not child:
-				return None
-		
-			try:
-				grandchildren = child.findall(grandchild_name)
-			except:
-				# what if grandchildren are missing
-				return None
-		
-			if not grandchildren:
-				return None
-		
-			return [v.text.lower().strip() for v in grandchildren if v.text]
-		
-		
-		artist_lst = []
-		
-		c = 0
-		
-		# parses an XML section into an element tree incrementally, returns an iterator providing (event, elem) pairs
-		# events is a list of events to report back
-		for ev, a in et.iterparse(self.DISCOGS_DUMP, events=("start", "end")):
-		
-			if (a.tag == "artist") and (ev == "end"):
-				
-				# found some artist's information; make a dictionary to collect
-				art_dict = defaultdict()
-				
-				art_dict["id_dg"] = __find(a, "id")
-				art_dict["name"] = __find(a, "name")
-				art_dict["real_name"] = __find(a, "realname")
-				
-				art_dict["name_variations"] = __find_kids(a, "namevariations", "name")
-				art_dict["aliases"] = __find_kids(a, "aliases", "name")
-				
-				artist_urls = __find_kids(a, "urls", "url")
-
-				art_dict["media"] = {}
-				
-				if artist_urls:
-					
-					for u in artist_urls:
-
-						for m in Artist.MEDIA:
-							if m in u:
-								art_dict['media'].update({m: u})
-				else:
-					continue  # no media - we aren't interested; next
-				
-				artist_lst.append(art_dict)
-		
-		
-		json.dump(artist_lst, open(f'{Artist.DATA_DIR}/discogs_.json', "w"), indent=4)
+		best = {}
+
+		for dg, m in reconciler.match_many(self.iter_artists(file_), names_of=discogs_names):
+			if m and ((m[0] not in best) or (best[m[0]][1] < m[1])):
+				best[m[0]] = (dg, m[1])
+
+		for i, (dg, score) in best.items():
+			self.artists[i].update({'id_dg': dg['id_dg'], 'media': dg['media']})
+
+		self._update_db((self.artists[i]['id'], {'id_dg': dg['id_dg'], 'media': dg['media']}) for i, (dg, score) in best.items())
+
+		print(f'matched {len(best)} artists to discogs')
+
+		return self
+
+	def merge_enrichment(self, files_=('artists_gig.json', 'artists_sc.json', 'artists_social.json')):
+		"""
+		join what the enrichment stages found into self.artists: every artist in files_ (in the data directory, read
+		one at a time) updates the artist with the same Spotify id, fetch records are merged; artists that aren't
+		in self.artists are left out
+		"""
+		by_id = {rc['id']: rc for rc in self.artists if rc.get('id')}
+
+		for file_ in files_:
+
+			n = 0
 
+			for e in self.iter_artists(file_):
+
+				rc = by_id.get(e.get('id'), None)
+
+				if rc is None:
+					continue
+
+				fetched = {**(rc.get('fetched') or {}), **(e.get('fetched') or {})}
+				rc.update({k: v for k, v in e.items() if k != 'fetched'})
+
+				if fetched:
+					rc['fetched'] = fetched
+
+				n += 1
+
+			print(f'merged {n} artists from {file_}')
+
+		return self
 
 			
 if __name__ == '__main__':
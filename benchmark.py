@@ -0,0 +1,381 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+"""
+benchmarks for the hot paths (name normalization, dedup, popularity lookups and Discogs parsing) on
+deterministic synthetic data; every benchmark runs in a fresh process so that its peak memory is its own
+and the results can be compared with a stored baseline to catch regressions before a large job
+
+	python benchmark.py [--scale 10k|1m|10m] [--only normalize_all ..] [--save-baseline]
+	python benchmark.py --check [--scale 1m]	# normalization still gives exactly the same names
+"""
+
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+BASELINE = 'benchmark_baseline.json'
+
+# how many single calls to time for latency percentiles
+LATENCY_SAMPLE = 100_000
+
+# synthetic data
+
+FIRST_NAMES = 'john paul george ringo kerri ian milky jesper aphex brian kylie nick dua billie frank amy james ' \
+				'david grace bjork fela nina miles ella stevie marvin aretha dolly johnny patti lou iggy'.split()
+WORDS = 'rolling stones chance persuader twin crystal castles arctic monkeys black keys flaming lips daft ' \
+		'punk chemical brothers massive attack sonic youth velvet underground talking heads pixies ' \
+		'cure smiths joy division new order kraftwerk depeche mode radio head boards canada four tet ' \
+		'burial moderat caribou jungle disclosure bonobo tycho nightmares wax orchestra collective'.split()
+NUMBERS = 'one two three five seven ten twelve twenty forty fifty ninety hundred'.split()
+GENRES = 'pop rock indie house techno hip-hop jazz folk metal punk soul funk ambient disco trance'.split()
+DECORATIONS = [lambda s: s, lambda s: s, lambda s: s.upper(), lambda s: s.title(), lambda s: f'the {s}',
+				lambda s: f'{s}!', lambda s: f'{s} (official)', lambda s: f'dj {s}', lambda s: s.replace(' ', '_'),
+				lambda s: f'{s}  ', lambda s: f'{s} :)', lambda s: f'{s} & friends', lambda s: f'{s} \U0001f3b8']
+
+def synthetic_names(n, seed=0):
+	"""
+	generator of n artist names made of real-looking words, spelled out numbers and the kind of
+	decorations (case, brackets, emoji, underscores..) normalization has to deal with
+	"""
+	rnd = random.Random(seed)
+
+	for _ in range(n):
+
+		k = rnd.random()
+
+		if k < 0.4:
+			name = f'{rnd.choice(FIRST_NAMES)} {rnd.choice(WORDS)}'
+		elif k < 0.8:
+			name = ' '.join(rnd.choices(WORDS, k=rnd.randint(1, 3)))
+		else:
+			name = f'{rnd.choice(WORDS)} {rnd.choice(NUMBERS)} {rnd.choice(NUMBERS)}'
+
+		yield rnd.choice(DECORATIONS)(name)
+
+# bits of names that every step of normalization reacts to
+TRICKY = NUMBERS + 'forty fourty eleven nineteen and the a dj ! !! ? ... :) :( _ - : ; / . , " ` \' [ ] { } ( ) & @'.split() + \
+			[' ', '  ', '\t', 'Ä', '\u00e9', '\U0001f3b8']
+
+def tricky_names(n, seed=0):
+	"""
+	generator of n names half from synthetic_names and half glued together at random from bits every step of
+	normalization reacts to, with or without spaces between them and in any case
+	"""
+	rnd = random.Random(seed)
+	names = synthetic_names(n, seed)
+
+	for name in names:
+
+		if rnd.random() < 0.5:
+			bits = rnd.choices(TRICKY + WORDS, k=rnd.randint(1, 8))
+			name = rnd.choice(['', ' ']).join(b.upper() if rnd.random() < 0.2 else b for b in bits)
+
+		yield name
+
+def check_normalizers(n, seed=0):
+	"""
+	diff the normalization engine against the reference normalizers (see normaliser_reference) on n tricky names;
+	returns how many names were normalized differently
+	"""
+	from normaliser_reference import mismatches
+
+	bad = 0
+
+	for flavour, name, expected, got in mismatches(tricky_names(n, seed)):
+		bad += 1
+		if bad <= 10:
+			print(f'{flavour}: {name!r} should be {expected!r}, not {got!r}')
+
+	print(f'checked {n} names against the reference normalizers: {bad} mismatches')
+
+	return bad
+
+def synthetic_artists(n, seed=0):
+	"""
+	generator of n artists shaped like Spotify search results; some names repeat and some artists
+	have zero popularity so that there's something to dedup
+	"""
+	rnd = random.Random(seed)
+	alphabet = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+	for i, name in enumerate(synthetic_names(n, seed)):
+
+		id_ = ''.join(rnd.choices(alphabet, k=22))
+
+		yield {'external_urls': {'spotify': f'https://open.spotify.com/artist/{id_}'},
+				'followers': {'href': None, 'total': rnd.randint(0, 5_000_000)},
+				'genres': rnd.sample(GENRES, rnd.randint(0, 3)),
+				'href': f'https://api.spotify.com/v1/artists/{id_}',
+				'id': id_,
+				'images': [],
+				'name': name,
+				'popularity': 0 if rnd.random() < 0.1 else rnd.randint(1, 100),
+				'type': 'artist',
+				'uri': f'spotify:artist:{id_}'}
+
+def write_discogs_dump(path, n, seed=0):
+	"""
+	write a Discogs-like artist dump with n artists to path; about a third of the artists have no URLs
+	"""
+	rnd = random.Random(seed)
+	media = 'facebook twitter youtube wikipedia soundcloud instagram'.split()
+
+	with open(path, 'w', encoding='utf-8') as f:
+
+		f.write('<artists>')
+
+		for i, name in enumerate(synthetic_names(n, seed), 1):
+
+			f.write(f'<artist><id>{i}</id><name>{escape(name)}</name><realname>{escape(rnd.choice(FIRST_NAMES))}</realname>')
+
+			if rnd.random() < 0.66:
+				urls = ''.join(f'<url>https://www.{m}.com/{i}</url>' for m in rnd.sample(media, rnd.randint(1, 3)))
+				f.write(f'<urls>{urls}<url>http://example.com/{i}</url></urls>')
+
+			f.write(f'<namevariations><name>{escape(name.lower())}</name></namevariations>'
+					f'<aliases><name id="{i + n}">{escape(rnd.choice(WORDS))}</name></aliases>'
+					'<data_quality>Needs Vote</data_quality></artist>\n')
+
+		f.write('</artists>\n')
+
+def write_reference_data(data_dir, n, seed=0):
+	"""
+	write the popularity reference lists and award winners Artist expects to find in data_dir
+	"""
+	rnd = random.Random(seed)
+	names = list(synthetic_names(max(n//100, 100), seed + 1))
+
+	from popularity import REFERENCE_FILES, AWARD_FILE
+
+	for f in REFERENCE_FILES.values():
+		with open(f'{data_dir}/{f}', 'w') as f_:
+			f_.write('\n'.join(rnd.sample(names, len(names)//2)) + '\n')
+
+	with open(f'{data_dir}/{AWARD_FILE}', 'w') as f:
+		json.dump({name: ['grammy'] for name in rnd.sample(names, len(names)//10)}, f)
+
+# benchmarks: every one gets the scale n and a data directory, prepares its inputs and returns
+# (how many records it processed, seconds it took, list of single call latencies in seconds or None)
+
+def _throughput_and_latency(func, items):
+
+	t0 = time.perf_counter()
+	for x in items:
+		func(x)
+	seconds = time.perf_counter() - t0
+
+	latencies = []
+	for x in items[:LATENCY_SAMPLE]:
+		t = time.perf_counter()
+		func(x)
+		latencies.append(time.perf_counter() - t)
+
+	return len(items), seconds, latencies
+
+def bench_normalizer(n, data_dir, workers):
+
+	from artistnormaliser import ArtistNameNormaliser
+
+	return _throughput_and_latency(ArtistNameNormaliser().normalize, list(synthetic_names(n)))
+
+def bench_normalise_name(n, data_dir, workers):
+
+	from artists import Artist
+
+	return _throughput_and_latency(Artist(create_new=True).normalise_name, list(synthetic_names(n)))
+
+def bench_normalize_all(n, data_dir, workers):
+
+	from artists import Artist
+
+	art = Artist(create_new=True, workers=workers)
+	art.artists = list(synthetic_artists(n))
+
+	t0 = time.perf_counter()
+	art.normalize_all()
+
+	return n, time.perf_counter() - t0, None
+
+def bench_drop_unpopular(n, data_dir, workers):
+
+	from artists import Artist
+	from store import write_artists
+
+	write_artists(f'{data_dir}/bench_artists.jsonl', synthetic_artists(n))
+
+	art = Artist(artist_file='bench_artists.jsonl', load=False, workers=workers)
+
+	t0 = time.perf_counter()
+	art.drop_unpopular(local=True, normalize=True)
+
+	return n, time.perf_counter() - t0, None
+
+def bench_popularity(n, data_dir, workers):
+
+	from artists import Artist
+
+	write_reference_data(data_dir, n)
+
+	art = Artist(create_new=True, workers=workers)
+	# building the snapshot isn't what we measure here
+	art.popularity_index
+
+	return _throughput_and_latency(art._popularity, art.normalise_many(list(synthetic_names(n, seed=1))))
+
+def bench_discogs(n, data_dir, workers):
+
+	from artists import Artist
+
+	write_discogs_dump(f'{data_dir}/bench_discogs.xml', n)
+
+	art = Artist(create_new=True)
+	art.DISCOGS_DUMP = f'{data_dir}/bench_discogs.xml'
+
+	t0 = time.perf_counter()
+	art.get_discogs(out_file='bench_discogs.jsonl', workers=workers)
+
+	return n, time.perf_counter() - t0, None
+
+BENCHMARKS = {'normalizer': bench_normalizer,
+				'normalise_name': bench_normalise_name,
+				'normalize_all': bench_normalize_all,
+				'drop_unpopular': bench_drop_unpopular,
+				'popularity': bench_popularity,
+				'discogs': bench_discogs}
+
+def percentiles(latencies, ps=(50, 90, 99)):
+	"""
+	returns a dictionary like {'p50': .., 'p99': .., 'max': ..} with latencies in microseconds
+	"""
+	if not latencies:
+		return None
+
+	latencies = sorted(latencies)
+	res = {f'p{p}': round(1e6*latencies[min(len(latencies) - 1, len(latencies)*p//100)], 2) for p in ps}
+	res['max'] = round(1e6*latencies[-1], 2)
+
+	return res
+
+def run_benchmark(name, n, workers=1):
+	"""
+	run benchmark name at scale n in a temporary working directory (with a data directory like Artist
+	wants) and return its results
+	"""
+	cwd = os.getcwd()
+
+	with tempfile.TemporaryDirectory() as tmp:
+
+		os.makedirs(f'{tmp}/data')
+		os.chdir(tmp)
+
+		# the benchmarked code is chatty
+		try:
+			with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+				records, seconds, latencies = BENCHMARKS[name](n, 'data', workers)
+		finally:
+			os.chdir(cwd)
+
+	return {'records': records,
+			'seconds': round(seconds, 3),
+			'records_per_sec': round(records/seconds, 1) if seconds else None,
+			'latency_us': percentiles(latencies),
+			# on Linux ru_maxrss is in kilobytes; note that it includes the inputs
+			'peak_memory_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1)}
+
+def run(names=None, scale='10k', workers=1):
+	"""
+	run benchmarks names (all if None), each in a process of its own; returns {benchmark: results}
+	"""
+	ctx = multiprocessing.get_context('spawn')
+	results = {}
+
+	for name in names or BENCHMARKS:
+
+		if name not in BENCHMARKS:
+			raise ValueError(f'there\'s no benchmark {name}!')
+
+		with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+			results[name] = pool.submit(run_benchmark, name, SCALES[scale], workers).result()
+
+		r = results[name]
+		lat = r['latency_us']
+		print(f'{name:15} {r["records"]:>10} records {r["seconds"]:>9.2f} sec {r["records_per_sec"]:>12}/sec '
+				f'{r["peak_memory_mb"]:>8} MB' + (f'  p50 {lat["p50"]} p99 {lat["p99"]} max {lat["max"]} us' if lat else ''))
+
+	return results
+
+def compare(results, baseline, tolerance=0.1):
+	"""
+	returns a list of regressions of results against baseline (results from an earlier run at the same scale):
+	throughput lower or peak memory higher than the baseline by more than tolerance
+	"""
+	regressions = []
+
+	for name, r in results.items():
+
+		b = baseline.get(name, None)
+
+		if b is None:
+			continue
+
+		if b['records_per_sec'] and r['records_per_sec'] < (1 - tolerance)*b['records_per_sec']:
+			regressions.append(f'{name}: {r["records_per_sec"]}/sec, baseline {b["records_per_sec"]}/sec')
+
+		if r['peak_memory_mb'] > (1 + tolerance)*b['peak_memory_mb']:
+			regressions.append(f'{name}: peak memory {r["peak_memory_mb"]} MB, baseline {b["peak_memory_mb"]} MB')
+
+	return regressions
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description='benchmark the hot paths on synthetic data')
+	parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), help='benchmarks to run; all by default')
+	parser.add_argument('--scale', choices=list(SCALES), default='10k', help='how many records to generate')
+	parser.add_argument('--workers', type=int, default=1, help='processes for the stages that can use more than one')
+	parser.add_argument('--baseline', default=BASELINE, help='baseline file to compare with')
+	parser.add_argument('--save-baseline', action='store_true', help='save the results as the baseline for this scale')
+	parser.add_argument('--tolerance', type=float, default=0.1, help='how much worse than the baseline is still fine')
+	parser.add_argument('--check', action='store_true', help='only check that the normalizers give exactly the same names as before')
+
+	args = parser.parse_args(argv)
+
+	if args.check:
+		return 1 if check_normalizers(SCALES[args.scale]) else 0
+
+	results = run(args.only, args.scale, args.workers)
+
+	baselines = json.load(open(args.baseline)) if os.path.exists(args.baseline) else {}
+
+	if args.save_baseline:
+		baselines.setdefault(args.scale, {}).update(results)
+		baselines[args.scale]['_env'] = {'python': sys.version.split()[0], 'cpus': os.cpu_count(), 'date': time.strftime('%Y-%m-%d')}
+		with open(args.baseline, 'w') as f:
+			json.dump(baselines, f, indent=4)
+		print(f'saved the baseline for {args.scale} to {args.baseline}')
+		return 0
+
+	if args.scale not in baselines:
+		print(f'no baseline for {args.scale} in {args.baseline} to compare with')
+		return 0
+
+	regressions = compare(results, baselines[args.scale], args.tolerance)
+
+	for r in regressions:
+		print(f'regression! {r}')
+
+	if not regressions:
+		print(f'no regressions against the baseline for {args.scale}')
+
+	return 1 if regressions else 0
+
+if __name__ == '__main__':
+
+	sys.exit(main())
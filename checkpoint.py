@@ -0,0 +1,70 @@
+import hashlib
+import os
+
+class Checkpoint:
+	"""
+	append-only journal of keys (like artist ids) that are done; every key is flushed to disk as soon
+	as it's added so after a crash we simply start again and skip whatever is in the journal
+	"""
+	def __init__(self, path):
+
+		self.path = path
+		self.done = set()
+
+		if os.path.exists(path):
+			with open(path) as f:
+				self.done = {l.strip() for l in f if l.strip()}
+
+		self._f = open(path, 'a')
+
+	def __len__(self):
+
+		return len(self.done)
+
+	def __contains__(self, key):
+
+		return str(key) in self.done
+
+	def add_many(self, keys):
+
+		keys = [str(k) for k in keys]
+
+		self._f.write(''.join(f'{k}\n' for k in keys))
+		self._f.flush()
+		os.fsync(self._f.fileno())
+
+		self.done.update(keys)
+
+	def add(self, key):
+
+		self.add_many([key])
+
+	def close(self):
+
+		self._f.close()
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, *exc):
+
+		self.close()
+
+def file_key(path, chunk_size=1 << 20):
+	"""
+	short hash of the content of file path, to tell journals for different inputs apart
+	"""
+	h = hashlib.sha256()
+
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(chunk_size), b''):
+			h.update(chunk)
+
+	return h.hexdigest()[:16]
+
+def names_key(names):
+	"""
+	short hash of a collection of strings (like genres), whatever their order
+	"""
+	return hashlib.sha256('\n'.join(sorted(set(names))).encode()).hexdigest()[:16]
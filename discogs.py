@@ -0,0 +1,235 @@
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from store import ArtistWriter
+
+try:
+	# lxml's iterparse is considerably faster and can skip everything but <artist> elements
+	from lxml import etree
+	LXML = True
+except ImportError:
+	import xml.etree.ElementTree as etree
+	LXML = False
+
+"""
+streaming ingestion of the Discogs artist dump (like discogs_20180401_artists.xml) that looks like
+
+<artists>
+	<artist>
+		<id>1</id><name>The Persuader</name><realname>Jesper Dahlbäck</realname>
+		<urls><url>https://www.facebook.com/..</url>..</urls>
+		<namevariations><name>Persuader</name>..</namevariations>
+		<aliases><name id="239">Jesper Dahlbäck</name>..</aliases>
+		..
+	</artist>
+	..
+</artists>
+"""
+
+def media_regex(media):
+	"""
+	one pattern finding every medium from media in a URL; it's a lookahead so that overlapping
+	names are all found
+	"""
+	return re.compile('(?=(' + '|'.join(re.escape(m) for m in media) + '))')
+
+def _find(element, child_name):
+
+	child = element.find(child_name)
+
+	return child.text.lower().strip() if (child is not None) and (child.text is not None) else None
+
+def _find_kids(element, child_name, grandchild_name):
+
+	child = element.find(child_name)
+
+	if child is None:
+		return None
+
+	return [v.text.lower().strip() for v in child.findall(grandchild_name) if v.text] or None
+
+def parse_artist(a, media, media_re):
+	"""
+	returns a dictionary with information about artist element a or None if the artist has no URLs
+	"""
+	artist_urls = _find_kids(a, 'urls', 'url')
+
+	if not artist_urls:
+		return None  # no media - we aren't interested
+
+	art_dict = {'id_dg': _find(a, 'id'),
+				'name': _find(a, 'name'),
+				'real_name': _find(a, 'realname'),
+				'name_variations': _find_kids(a, 'namevariations', 'name'),
+				'aliases': _find_kids(a, 'aliases', 'name'),
+				'media': {}}
+
+	for u in artist_urls:
+
+		found = set(media_re.findall(u))
+
+		if found:
+			for m in media:
+				if m in found:
+					art_dict['media'].update({m: u})
+
+	return art_dict
+
+def iter_artists(source, media):
+	"""
+	generator of artist dictionaries from source (a file name or a binary file object); every parsed
+	<artist> element is cleared as soon as we're done with it so memory doesn't grow with the dump
+	"""
+	media_re = media_regex(media)
+
+	if LXML:
+
+		for ev, a in etree.iterparse(source, events=('end',), tag='artist'):
+
+			art_dict = parse_artist(a, media, media_re)
+
+			# free this artist and whatever came before it
+			a.clear()
+			while a.getprevious() is not None:
+				del a.getparent()[0]
+
+			if art_dict:
+				yield art_dict
+	else:
+
+		root = None
+
+		for ev, a in etree.iterparse(source, events=('start', 'end')):
+
+			if root is None:
+				root = a
+
+			if (ev == 'end') and (a.tag == 'artist'):
+
+				art_dict = parse_artist(a, media, media_re)
+
+				root.clear()
+
+				if art_dict:
+					yield art_dict
+
+
+class _RangeReader:
+	"""
+	binary file-like object reading bytes start to end of path wrapped in <artists>..</artists>
+	so that the range can be parsed as a document of its own
+	"""
+	def __init__(self, path, start, end):
+
+		self._f = open(path, 'rb')
+		self._f.seek(start)
+		self._left = end - start
+		self._head = b'<artists>'
+		self._tail = b'</artists>'
+
+	def read(self, n=-1):
+
+		n = n if n > 0 else 1 << 20
+
+		if self._head:
+			res, self._head = self._head, b''
+			return res
+
+		if self._left > 0:
+			res = self._f.read(min(n, self._left))
+			self._left -= len(res)
+			return res
+
+		res, self._tail = self._tail, b''
+		self._f.close()
+
+		return res
+
+def split_ranges(path, parts):
+	"""
+	split the dump into at most parts byte ranges [start, end) each starting at an <artist> tag
+	"""
+	size = os.path.getsize(path)
+	marker = b'<artist>'
+
+	def _next_artist(f, offset):
+
+		f.seek(offset)
+		buf = b''
+
+		while True:
+
+			chunk = f.read(1 << 20)
+
+			if not chunk:
+				return None
+
+			# keep a few bytes from the previous chunk in case the marker is split between chunks
+			i = (buf[-len(marker):] + chunk).find(marker)
+
+			if i >= 0:
+				return offset + i - len(buf[-len(marker):])
+
+			buf = chunk
+			offset += len(chunk)
+
+	with open(path, 'rb') as f:
+
+		starts = []
+
+		for p in range(parts):
+			s = _next_artist(f, size*p//parts)
+			if (s is not None) and (s not in starts):
+				starts.append(s)
+
+		# the last range ends where the </artists> tag starts
+		f.seek(max(0, size - 1024))
+		tail = f.read()
+		end = size - len(tail) + tail.rfind(b'</artists>')
+
+	return [(s, e) for s, e in zip(starts, starts[1:] + [end])]
+
+def _ingest_range(args):
+
+	source, out_path, media = args
+
+	if isinstance(source, tuple):
+		source = _RangeReader(*source)
+
+	with ArtistWriter(out_path) as w:
+		w.write_many(iter_artists(source, media))
+
+	return w.count
+
+def ingest(path, out_path, media, workers=1):
+	"""
+	parse the Discogs dump at path and write all artists with media to out_path, one at a time;
+	with workers > 1 the dump is split into byte ranges which are parsed on multiple cores
+	and then joined (out_path must be a .jsonl or .jsonl.gz file then); returns how many
+	artists were written
+	"""
+	if workers <= 1:
+		return _ingest_range((path, out_path, media))
+
+	ext = next((e for e in ('.jsonl.gz', '.jsonl') if out_path.endswith(e)), None)
+
+	if not ext:
+		raise ValueError(f'{out_path} has to be a .jsonl or .jsonl.gz file to parse on {workers} cores!')
+
+	ranges = split_ranges(path, workers)
+	part_paths = [f'{out_path[:-len(ext)]}.{i}{ext}' for i in range(len(ranges))]
+
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		n = sum(pool.map(_ingest_range, [((path, s, e), p, media) for (s, e), p in zip(ranges, part_paths)]))
+
+	# line-delimited files (and gzip members) can simply be concatenated
+	with open(f'{out_path}.part', 'wb') as f:
+		for p in part_paths:
+			with open(p, 'rb') as part:
+				shutil.copyfileobj(part, f)
+			os.remove(p)
+
+	os.replace(f'{out_path}.part', out_path)
+
+	return n
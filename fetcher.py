@@ -0,0 +1,354 @@
+import asyncio
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from metrics import REGISTRY as metrics
+
+class FetchError(Exception):
+	"""
+	a request failed and retrying wouldn't help (or we ran out of retries)
+	"""
+	def __init__(self, url, status=None, reason=None):
+
+		self.url = url
+		self.status = status
+
+		super().__init__(f'{url}: {status or ""} {reason or ""}'.strip())
+
+
+class RateLimiter:
+	"""
+	token bucket allowing on average rate requests per second and bursts of up to burst requests;
+	it can be shared by threads (wait) and coroutines (acquire)
+	"""
+	def __init__(self, rate, burst=None):
+
+		self.rate = rate
+		self.burst = burst or max(1, int(rate))
+
+		self._tokens = self.burst
+		self._last = time.monotonic()
+		self._lock = threading.Lock()
+
+	def _reserve(self):
+		"""
+		take a token and return how many seconds to wait before it can be used
+		"""
+		with self._lock:
+
+			now = time.monotonic()
+
+			self._tokens = min(self.burst, self._tokens + (now - self._last)*self.rate)
+			self._last = now
+			self._tokens -= 1
+
+			return -self._tokens/self.rate if self._tokens < 0 else 0
+
+	def wait(self):
+
+		delay = self._reserve()
+
+		if delay:
+			time.sleep(delay)
+
+	async def acquire(self):
+
+		delay = self._reserve()
+
+		if delay:
+			await asyncio.sleep(delay)
+
+
+class AsyncFetcher:
+	"""
+	pooled keep-alive HTTP client for fetching many pages concurrently; at most concurrency requests
+	(and per_host requests to any single host) are in flight, every request first takes a token
+	from rate_limiter if there is one and failed requests are retried with exponential backoff;
+
+	use as
+
+		async with AsyncFetcher(concurrency=20) as f:
+			r = await f.get_json(url, params={..})
+	"""
+	# these are worth retrying
+	RETRY_STATUS = {429, 500, 502, 503, 504}
+
+	def __init__(self, concurrency=10, per_host=0, rate_limiter=None, retries=3, backoff=0.5, timeout=30, cache=None, source=None):
+		"""
+		if there's a cache (a ResponseCache), fresh responses are taken from there; source names the
+		API so the cache knows how long its responses stay fresh
+		"""
+		self.concurrency = concurrency
+		self.per_host = per_host
+		self.rate_limiter = rate_limiter
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.cache = cache
+		self.source = source
+
+		self.session = None
+
+	async def __aenter__(self):
+
+		import aiohttp
+
+		self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host),
+												timeout=aiohttp.ClientTimeout(total=self.timeout))
+		self._sem = asyncio.Semaphore(self.concurrency)
+
+		return self
+
+	async def __aexit__(self, *exc):
+
+		await self.session.close()
+
+	async def get_json(self, url, params=None):
+
+		return json.loads(await self.get_text(url, params))
+
+	async def get_text(self, url, params=None):
+
+		if self.cache is not None:
+
+			body = self.cache.get(self.source, url, params)
+
+			if body is None:
+				metrics.inc('cache_misses', self.source)
+				body = await self._get(url, params)
+				self.cache.set(self.source, url, params, body)
+			else:
+				metrics.inc('cache_hits', self.source)
+
+			return body
+
+		return await self._get(url, params)
+
+	async def _get(self, url, params):
+
+		import aiohttp
+
+		async with self._sem:
+
+			for attempt in range(self.retries + 1):
+
+				if self.rate_limiter:
+					await self.rate_limiter.acquire()
+
+				metrics.inc('requests', self.source)
+				t0 = time.perf_counter()
+
+				try:
+					async with self.session.get(url, params=params) as r:
+
+						if r.status < 400:
+							body = await r.text()
+							metrics.observe('latency', time.perf_counter() - t0, self.source)
+							return body
+
+						error = FetchError(url, r.status, r.reason)
+
+				except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+					error = FetchError(url, reason=repr(e))
+
+				metrics.observe('latency', time.perf_counter() - t0, self.source)
+
+				# client errors like 404 won't go away by retrying
+				if (error.status and (error.status not in AsyncFetcher.RETRY_STATUS)) or (attempt == self.retries):
+					metrics.inc('errors', self.source)
+					raise error
+
+				metrics.inc('retries', self.source)
+
+				# back off before the next attempt, with some jitter so that workers don't retry in sync
+				await asyncio.sleep(self.backoff*(2**attempt)*(1 + random.random()))
+
+
+class ResponseCache:
+	"""
+	on-disk (SQLite) cache of responses keyed by source, URL and parameters (except for API keys); a
+	response is fresh for ttl[source] seconds and when the cache grows over max_bytes the least recently
+	used responses are dropped; it's shared by all fetchers, sync or async
+	"""
+	# how long responses from each source stay fresh, in seconds
+	TTL = {'everynoise': 30*86400,
+			'songkick_search': 30*86400,
+			'songkick_gigs': 7*86400,
+			'soundcloud': 7*86400,
+			'facebook': 86400,
+			'twitter': 86400}
+
+	# these parameters don't change the response so they aren't part of the key
+	IGNORE_PARAMS = {'apikey', 'api_key', 'client_id'}
+
+	def __init__(self, path, ttl=None, default_ttl=86400, max_bytes=1 << 30):
+
+		self.path = path
+		self.ttl = {**ResponseCache.TTL, **(ttl or {})}
+		self.default_ttl = default_ttl
+		self.max_bytes = max_bytes
+
+		self.hits = self.misses = 0
+
+		self._lock = threading.Lock()
+		self.conn = sqlite3.connect(path, check_same_thread=False)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+
+		with self.conn:
+			self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, source TEXT, fetched_at REAL,
+									accessed_at REAL, size INTEGER, body TEXT)''')
+			self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+
+		self._size = self.conn.execute('SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+
+	def key(self, source, url, params=None):
+
+		params = sorted((k, str(v)) for k, v in (params or {}).items() if k not in ResponseCache.IGNORE_PARAMS)
+
+		return hashlib.sha1(json.dumps([source, url, params]).encode()).hexdigest()
+
+	def get(self, source, url, params=None):
+		"""
+		returns the cached response body or None if there's nothing fresh
+		"""
+		k = self.key(source, url, params)
+		now = time.time()
+
+		with self._lock:
+
+			r = self.conn.execute('SELECT body FROM responses WHERE key=? AND fetched_at>?',
+									(k, now - self.ttl.get(source, self.default_ttl))).fetchone()
+
+			if r is None:
+				self.misses += 1
+				return None
+
+			with self.conn:
+				self.conn.execute('UPDATE responses SET accessed_at=? WHERE key=?', (now, k))
+
+			self.hits += 1
+
+		return r[0]
+
+	def set(self, source, url, params, body):
+
+		k = self.key(source, url, params)
+		now = time.time()
+		size = len(body)
+
+		with self._lock, self.conn:
+
+			old = self.conn.execute('SELECT size FROM responses WHERE key=?', (k,)).fetchone()
+
+			self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)', (k, source, now, now, size, body))
+			self._size += size - (old[0] if old else 0)
+
+			if self._size > self.max_bytes:
+				self._evict()
+
+	def _evict(self):
+		"""
+		drop the least recently used responses until the cache is down to 90% of max_bytes
+		"""
+		for k, size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall():
+
+			if self._size <= 0.9*self.max_bytes:
+				break
+
+			self.conn.execute('DELETE FROM responses WHERE key=?', (k,))
+			self._size -= size
+
+	def stats(self):
+
+		return {'hits': self.hits, 'misses': self.misses, 'bytes': self._size,
+				'responses': self.conn.execute('SELECT count(*) FROM responses').fetchone()[0]}
+
+	def close(self):
+
+		self.conn.close()
+
+
+class Fetcher:
+	"""
+	blocking HTTP client (one keep-alive requests session) for the one-at-a-time fetchers; responses
+	come from cache if there is a fresh one there
+	"""
+	def __init__(self, source, cache=None, rate_limiter=None, retries=3, backoff=0.5, timeout=30):
+
+		import requests
+
+		self.source = source
+		self.cache = cache
+		self.rate_limiter = rate_limiter
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+
+		self.session = requests.Session()
+
+	def get_json(self, url, params=None):
+
+		return json.loads(self.get_text(url, params))
+
+	def get_text(self, url, params=None):
+
+		import requests
+
+		if self.cache is not None:
+			body = self.cache.get(self.source, url, params)
+			if body is not None:
+				metrics.inc('cache_hits', self.source)
+				return body
+			metrics.inc('cache_misses', self.source)
+
+		for attempt in range(self.retries + 1):
+
+			if self.rate_limiter:
+				self.rate_limiter.wait()
+
+			metrics.inc('requests', self.source)
+
+			try:
+				with metrics.timer('latency', self.source):
+					r = self.session.get(url, params=params, timeout=self.timeout)
+			except requests.RequestException as e:
+				error = FetchError(url, reason=repr(e))
+			else:
+				if r.status_code < 400:
+					if self.cache is not None:
+						self.cache.set(self.source, url, params, r.text)
+					return r.text
+				error = FetchError(url, r.status_code, r.reason)
+
+			if (error.status and (error.status not in AsyncFetcher.RETRY_STATUS)) or (attempt == self.retries):
+				metrics.inc('errors', self.source)
+				raise error
+
+			metrics.inc('retries', self.source)
+
+			time.sleep(self.backoff*(2**attempt)*(1 + random.random()))
+
+
+async def map_ordered(func, items, workers):
+	"""
+	await func(item) for every item in items using at most workers coroutines; returns the results in
+	the same order as items, with an exception object in place of any result that failed
+	"""
+	items = list(items)
+	results = [None]*len(items)
+	todo = iter(range(len(items)))
+
+	async def _worker():
+
+		for i in todo:
+			try:
+				results[i] = await func(items[i])
+			except Exception as e:
+				results[i] = e
+
+	await asyncio.gather(*[_worker() for _ in range(min(workers, len(items)) or 1)])
+
+	return results
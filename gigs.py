@@ -0,0 +1,251 @@
+import json
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import compress
+
+"""
+gigographies from Songkick flattened into a columnar table with one row per artist and event; every column
+is a typed array (strings like countries and cities are stored as codes into a list of distinct values) and
+rows are sorted by date, so a date range is a slice and counting is done by C loops (Counter, compress)
+rather than by walking nested JSON; the table is saved as one binary file per column plus meta.json
+
+	gigs = GigTable.from_artists(read_artists('data/artists_gig.jsonl'))
+	gigs.count_by('country', start='2017-01-01', end='2017-12-31', billing='headline')
+	gigs.artists_with_gigs_in('Australia')
+"""
+
+# column name: array typecode
+COLUMNS = {'artist': 'l',		# index into the artist table
+			'event': 'q',		# Songkick event id
+			'date': 'l',		# like 20180623, 0 if unknown
+			'country': 'l',		# codes into the lists of distinct values
+			'city': 'l',
+			'venue': 'l',
+			'type': 'l',
+			'headline': 'b',	# 1 if the artist was the headliner
+			'lat': 'd',
+			'lng': 'd'}
+
+# columns with codes
+CODED = ('country', 'city', 'venue', 'type')
+
+def _date(s):
+	"""
+	'2018-06-23' as 20180623 or 0
+	"""
+	try:
+		return int(s[:4])*10000 + int(s[5:7])*100 + int(s[8:10])
+	except (TypeError, ValueError):
+		return 0
+
+def _float(x):
+
+	return float(x) if isinstance(x, (int, float)) else float('nan')
+
+def flatten(rc):
+	"""
+	generator of rows (dictionaries) for every gig of artist rc
+	"""
+	for e in rc.get('gigs') or []:
+
+		venue = e.get('venue') or {}
+		metro = venue.get('metroArea') or {}
+
+		# the performance of this artist tells if it was the headliner
+		billing = next((p.get('billing') for p in e.get('performance') or []
+							if (p.get('artist') or {}).get('id') == rc.get('id_sk')), None)
+
+		yield {'event': e.get('id') or 0,
+				'date': _date((e.get('start') or {}).get('date')),
+				'country': (metro.get('country') or {}).get('displayName'),
+				'city': metro.get('displayName') or (e.get('location') or {}).get('city'),
+				'venue': venue.get('displayName'),
+				'type': e.get('type'),
+				'headline': 1 if billing == 'headline' else 0,
+				'lat': _float(venue.get('lat', (e.get('location') or {}).get('lat'))),
+				'lng': _float(venue.get('lng', (e.get('location') or {}).get('lng')))}
+
+
+class GigTable:
+	"""
+	one row per artist and event; artist_ids and artist_names are the artist table the artist column points to
+	"""
+	def __init__(self):
+
+		self.columns = {c: array(t) for c, t in COLUMNS.items()}
+		self.values = {c: [] for c in CODED}
+		self.artist_ids = []
+		self.artist_names = []
+
+		self._codes = {c: {} for c in CODED}
+
+	def __len__(self):
+
+		return len(self.columns['date'])
+
+	def _code(self, column, value):
+
+		codes = self._codes[column]
+		code = codes.get(value, None)
+
+		if code is None:
+			code = codes[value] = len(self.values[column])
+			self.values[column].append(value)
+
+		return code
+
+	@classmethod
+	def from_artists(cls, artists):
+		"""
+		build the table from artists with gigs (any iterable, e.g. read_artists(..)); rows end up sorted by date
+		"""
+		t = cls()
+		cols = {c: array(tc) for c, tc in COLUMNS.items()}
+
+		for rc in artists:
+
+			if not rc.get('gigs'):
+				continue
+
+			a = len(t.artist_ids)
+			t.artist_ids.append(rc.get('id'))
+			t.artist_names.append(rc.get('name'))
+
+			for row in flatten(rc):
+				cols['artist'].append(a)
+				for c in COLUMNS:
+					if c != 'artist':
+						cols[c].append(t._code(c, row[c]) if c in CODED else row[c])
+
+		order = sorted(range(len(cols['date'])), key=cols['date'].__getitem__)
+
+		for c, col in cols.items():
+			t.columns[c] = array(COLUMNS[c], [col[i] for i in order])
+
+		return t
+
+	# queries
+
+	def _range(self, start=None, end=None):
+		"""
+		slice of rows with dates from start to end (both included, like '2017-01-01')
+		"""
+		dates = self.columns['date']
+
+		lo = bisect_left(dates, _date(start)) if start else 0
+		hi = bisect_right(dates, _date(end)) if end else len(dates)
+
+		return slice(lo, hi)
+
+	def _select(self, column, start=None, end=None, billing=None):
+		"""
+		values of column (still as codes) for the rows in a date range, only headline (billing='headline')
+		or support (billing='support') gigs if billing is given
+		"""
+		rows = self._range(start, end)
+		col = self.columns[column][rows]
+
+		if billing is None:
+			return col
+
+		headline = self.columns['headline'][rows]
+
+		if billing == 'headline':
+			return compress(col, headline)
+
+		if billing == 'support':
+			return compress(col, map((1).__xor__, headline))
+
+		raise ValueError(f'billing is either headline or support, not {billing}!')
+
+	def count_by(self, column, start=None, end=None, billing=None):
+		"""
+		returns a Counter {value: number of gigs} for column like 'country', 'city', 'venue' or 'type'
+		"""
+		counts = Counter(self._select(column, start, end, billing))
+
+		if column not in CODED:
+			return counts
+
+		values = self.values[column]
+
+		return Counter({values[code]: n for code, n in counts.items()})
+
+	def count(self, start=None, end=None, billing=None, **where):
+		"""
+		how many gigs there are in a date range, e.g. count(start='2018-01-01', country='Australia')
+		"""
+		if where:
+			(column, value), = where.items()
+			return self.count_by(column, start, end, billing).get(value, 0)
+
+		if billing is None:
+			rows = self._range(start, end)
+			return rows.stop - rows.start
+
+		return sum(1 for _ in self._select('date', start, end, billing))
+
+	def _codes_for(self, column):
+
+		if not self._codes[column]:
+			self._codes[column] = {v: i for i, v in enumerate(self.values[column])}
+
+		return self._codes[column]
+
+	def artists_with_gigs_in(self, country, start=None, end=None, billing=None, names=True):
+		"""
+		returns a set of names (or ids if names is False) of artists with gigs in country
+		"""
+		code = self._codes_for('country').get(country, None)
+
+		if code is None:
+			return set()
+
+		countries = self._select('country', start, end, billing)
+		artists = set(compress(self._select('artist', start, end, billing), map(code.__eq__, countries)))
+
+		table = self.artist_names if names else self.artist_ids
+
+		return {table[a] for a in artists}
+
+	# storage
+
+	def save(self, dir_):
+		"""
+		write every column to its own binary file in dir_ and everything else to dir_/meta.json (written last,
+		so a table with meta.json is complete)
+		"""
+		os.makedirs(dir_, exist_ok=True)
+
+		for c, col in self.columns.items():
+			with open(f'{dir_}/{c}.bin', 'wb') as f:
+				col.tofile(f)
+
+		meta = {'rows': len(self), 'typecodes': COLUMNS, 'values': self.values,
+				'artist_ids': self.artist_ids, 'artist_names': self.artist_names}
+
+		with open(f'{dir_}/meta.json.part', 'w') as f:
+			json.dump(meta, f)
+
+		os.replace(f'{dir_}/meta.json.part', f'{dir_}/meta.json')
+
+	@classmethod
+	def load(cls, dir_):
+
+		meta = json.load(open(f'{dir_}/meta.json'))
+
+		t = cls()
+		t.values = meta['values']
+		t.artist_ids = meta['artist_ids']
+		t.artist_names = meta['artist_names']
+		t._codes = {c: {} for c in CODED}
+
+		for c, tc in meta['typecodes'].items():
+			col = array(tc)
+			with open(f'{dir_}/{c}.bin', 'rb') as f:
+				col.fromfile(f, meta['rows'])
+			t.columns[c] = col
+
+		return t
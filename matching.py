@@ -0,0 +1,143 @@
+from collections import Counter, defaultdict
+from artistnormaliser import normalise_name
+
+"""
+fuzzy matching of artist names from a source (Songkick, SoundCloud, Discogs..) against the catalogue;
+comparing every source name with every catalogue name is out of the question for millions of names so
+catalogue names are put into blocks by keys (character n-grams and token prefixes) and a source name is only
+compared with the names it shares a block with
+"""
+
+def ngrams(name, n=3):
+	"""
+	returns a set of character n-grams of name padded with spaces
+	"""
+	padded = f' {name} '
+
+	return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+def blocking_keys(name, n=3, prefix=4):
+
+	return {f'g:{g}' for g in ngrams(name, n)} | {f'p:{t[:prefix]}' for t in name.split()}
+
+def similarity(grams1, grams2):
+	"""
+	Dice coefficient of two sets of n-grams: 1 if they're the same, 0 if they have nothing in common
+	"""
+	if not grams1 or not grams2:
+		return 0.
+
+	return 2*len(grams1 & grams2)/(len(grams1) + len(grams2))
+
+def discogs_names(rc):
+	"""
+	all names a Discogs artist goes by: the name, name variations and aliases
+	"""
+	return [rc['name']] + (rc.get('name_variations') or []) + (rc.get('aliases') or [])
+
+
+class BlockingIndex:
+	"""
+	inverted index from blocking keys to catalogue entries; blocks with more than max_block
+	entries (like the n-gram ' th') don't tell us much so they are ignored when looking up candidates
+	"""
+	def __init__(self, n=3, prefix=4, max_block=2000):
+
+		self.n = n
+		self.prefix = prefix
+		self.max_block = max_block
+
+		self.blocks = defaultdict(list)
+		# (entry id, n-grams) for every name in the index; an entry may have a few names
+		self.names = []
+
+	def add(self, id_, names):
+		"""
+		add catalogue entry id_ known under normalized names (a list - the first one is the main name,
+		the rest are alternate keys)
+		"""
+		for name in names:
+
+			if not name:
+				continue
+
+			k = len(self.names)
+			self.names.append((id_, ngrams(name, self.n)))
+
+			for key in blocking_keys(name, self.n, self.prefix):
+				self.blocks[key].append(k)
+
+	def candidates(self, name, top=50):
+		"""
+		returns indices (into self.names) of at most top names sharing the most blocks with name
+		"""
+		shared = Counter()
+
+		for key in blocking_keys(name, self.n, self.prefix):
+
+			block = self.blocks.get(key, None)
+
+			if block and (len(block) <= self.max_block):
+				shared.update(block)
+
+		return [k for k, _ in shared.most_common(top)]
+
+
+class Reconciler:
+	"""
+	match source names against catalogue entries; an exact match of normalized names always wins,
+	otherwise the candidate with the best similarity at or above threshold is the match
+	"""
+	def __init__(self, catalogue, normaliser=normalise_name, threshold=0.8, n=3, prefix=4, max_block=2000):
+		"""
+		catalogue is an iterable of pairs (entry id, list of names)
+		"""
+		self.normaliser = normaliser
+		self.threshold = threshold
+		self.n = n
+
+		self.index = BlockingIndex(n, prefix, max_block)
+		self.exact = {}
+
+		for id_, names in catalogue:
+
+			names = [self.normaliser(name) for name in names if name]
+
+			for name in names:
+				self.exact.setdefault(name, id_)
+
+			self.index.add(id_, names)
+
+	def match(self, names):
+		"""
+		returns (entry id, score) for the best match of a source record known under names or None
+		"""
+		names = [self.normaliser(name) for name in names if name]
+
+		for name in names:
+			if name in self.exact:
+				return (self.exact[name], 1.)
+
+		best = None
+
+		for name in names:
+
+			grams = ngrams(name, self.n)
+
+			for k in self.index.candidates(name):
+
+				id_, grams_ = self.index.names[k]
+				score = similarity(grams, grams_)
+
+				if (score >= self.threshold) and ((best is None) or (score > best[1])):
+					best = (id_, score)
+
+		return best
+
+	def match_many(self, records, names_of=lambda rc: [rc['name']]):
+		"""
+		generator of (record, match) for records from a source; names_of(record) gives a list of names
+		the record goes by, e.g. discogs_names
+		"""
+		for rc in records:
+			yield rc, self.match(names_of(rc))
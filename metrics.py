@@ -0,0 +1,287 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+counters, latency histograms and progress of long running stages; everything goes into one registry
+(REGISTRY) that can be dumped to a JSON file or served over HTTP while a crawl is running:
+
+	REGISTRY.inc('requests', 'songkick_search')
+	with REGISTRY.timer('latency', 'songkick_search'):
+		..
+	REGISTRY.serve(9100)   # http://localhost:9100/metrics (text) or /metrics.json
+"""
+
+class Histogram:
+	"""
+	latencies (in seconds) counted in fixed buckets so that recording one is cheap and memory doesn't grow;
+	percentiles are approximated by bucket upper bounds
+	"""
+	BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60]
+
+	def __init__(self):
+
+		self.counts = [0]*(len(Histogram.BOUNDS) + 1)
+		self.count = 0
+		self.sum = 0.
+		self.max = 0.
+
+	def observe(self, seconds):
+
+		self.counts[bisect.bisect_left(Histogram.BOUNDS, seconds)] += 1
+		self.count += 1
+		self.sum += seconds
+		self.max = max(self.max, seconds)
+
+	def percentile(self, p):
+
+		if not self.count:
+			return None
+
+		rank = p*self.count/100
+		seen = 0
+
+		for i, c in enumerate(self.counts):
+			seen += c
+			if seen >= rank:
+				return Histogram.BOUNDS[i] if i < len(Histogram.BOUNDS) else self.max
+
+	def to_dict(self):
+
+		return {'count': self.count,
+				'mean': round(self.sum/self.count, 4) if self.count else None,
+				'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+				'max': round(self.max, 4),
+				'buckets': dict(zip([str(b) for b in Histogram.BOUNDS] + ['inf'], self.counts))}
+
+
+class Metrics:
+	"""
+	thread-safe registry of counters and histograms, both keyed by a name and a source (like 'songkick_search'),
+	and of the progress of running stages
+	"""
+	def __init__(self):
+
+		self.counters = {}
+		self.histograms = {}
+		self.progress = {}
+		self.started = time.time()
+
+		self._lock = threading.Lock()
+
+	def inc(self, name, source=None, n=1):
+
+		with self._lock:
+			self.counters[(name, source)] = self.counters.get((name, source), 0) + n
+
+	def observe(self, name, seconds, source=None):
+
+		with self._lock:
+			h = self.histograms.get((name, source), None)
+			if h is None:
+				h = self.histograms[(name, source)] = Histogram()
+			h.observe(seconds)
+
+	@contextmanager
+	def timer(self, name, source=None):
+		"""
+		record how long the with block takes in histogram name
+		"""
+		t0 = time.perf_counter()
+
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - t0, source)
+
+	def get(self, name, source=None):
+
+		return self.counters.get((name, source), 0)
+
+	def reset(self):
+
+		with self._lock:
+			self.counters.clear()
+			self.histograms.clear()
+			self.progress.clear()
+			self.started = time.time()
+
+	def snapshot(self):
+		"""
+		everything as a JSON-serializable dictionary like {'counters': {source: {name: value}}, ..}
+		"""
+		with self._lock:
+
+			counters = {}
+			for (name, source), v in self.counters.items():
+				counters.setdefault(source or '', {})[name] = v
+
+			histograms = {}
+			for (name, source), h in self.histograms.items():
+				histograms.setdefault(source or '', {})[name] = h.to_dict()
+
+			return {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+					'uptime': round(time.time() - self.started, 1),
+					'counters': counters,
+					'histograms': histograms,
+					'progress': {k: dict(v) for k, v in self.progress.items()}}
+
+	def to_text(self):
+		"""
+		the metrics in the Prometheus text format
+		"""
+		s = self.snapshot()
+		lines = []
+
+		for source, cs in s['counters'].items():
+			for name, v in cs.items():
+				lines.append(f'{name}{{source="{source}"}} {v}')
+
+		for source, hs in s['histograms'].items():
+			for name, h in hs.items():
+				cum = 0
+				for b, c in h['buckets'].items():
+					cum += c
+					lines.append(f'{name}_bucket{{source="{source}",le="{"+Inf" if b == "inf" else b}"}} {cum}')
+				lines.append(f'{name}_count{{source="{source}"}} {h["count"]}')
+
+		for stage, p in s['progress'].items():
+			for k in ('done', 'total', 'per_sec', 'eta'):
+				if p.get(k) is not None:
+					lines.append(f'progress_{k}{{stage="{stage}"}} {p[k]}')
+
+		return '\n'.join(lines) + '\n'
+
+	def dump(self, path):
+		"""
+		write a snapshot to JSON file path (atomically so a reader never sees half a file)
+		"""
+		with open(f'{path}.part', 'w') as f:
+			json.dump(self.snapshot(), f, indent=4)
+
+		os.replace(f'{path}.part', path)
+
+	def autodump(self, path, interval=10):
+		"""
+		dump to path every interval seconds in a background thread (until the process ends)
+		"""
+		def _loop():
+			while True:
+				time.sleep(interval)
+				self.dump(path)
+
+		threading.Thread(target=_loop, daemon=True).start()
+
+	def serve(self, port=9100, host='127.0.0.1'):
+		"""
+		serve the metrics at http://host:port/metrics (text) and /metrics.json from a background thread;
+		returns the server (call shutdown() on it to stop)
+		"""
+		from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+		metrics = self
+
+		class _Handler(BaseHTTPRequestHandler):
+
+			def do_GET(self):
+
+				if self.path.startswith('/metrics.json'):
+					body, type_ = json.dumps(metrics.snapshot()).encode(), 'application/json'
+				elif self.path.startswith('/metrics'):
+					body, type_ = metrics.to_text().encode(), 'text/plain; version=0.0.4'
+				else:
+					self.send_error(404)
+					return
+
+				self.send_response(200)
+				self.send_header('Content-Type', type_)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, *args):
+				pass
+
+		server = ThreadingHTTPServer((host, port), _Handler)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+
+		print(f'serving metrics at http://{host}:{server.server_port}/metrics')
+
+		return server
+
+
+REGISTRY = Metrics()
+
+
+class Progress:
+	"""
+	progress of a stage going through total items: update() as items get done and a line with
+	the rate and ETA is printed at most every interval seconds; the progress is in the metrics too
+	"""
+	def __init__(self, stage, total=None, interval=10, metrics=REGISTRY):
+
+		self.stage = stage
+		self.total = total
+		self.interval = interval
+		self.metrics = metrics
+
+		self.done_ = 0
+		self.t0 = self._last = time.time()
+		self._lock = threading.Lock()
+
+		self.metrics.progress[stage] = self._state()
+
+	def _state(self):
+
+		elapsed = time.time() - self.t0
+		per_sec = self.done_/elapsed if elapsed > 0 else None
+		eta = (self.total - self.done_)/per_sec if (self.total is not None) and per_sec else None
+
+		return {'done': self.done_, 'total': self.total, 'elapsed': round(elapsed, 1),
+				'per_sec': round(per_sec, 2) if per_sec is not None else None,
+				'eta': round(eta, 1) if eta is not None else None}
+
+	@staticmethod
+	def _fmt(seconds):
+
+		return '{:.0f} min {:.0f} sec'.format(*divmod(seconds, 60))
+
+	def _line(self, s):
+
+		of = f'/{self.total} ({100*self.done_/self.total:.0f}%)' if self.total else ''
+		eta = f', ETA {Progress._fmt(s["eta"])}' if s['eta'] is not None else ''
+
+		return f'{self.stage}: {self.done_}{of} at {s["per_sec"] or 0:.1f}/sec{eta}'
+
+	def update(self, n=1):
+
+		with self._lock:
+
+			self.done_ += n
+			s = self.metrics.progress[self.stage] = self._state()
+
+			now = time.time()
+			if now - self._last < self.interval:
+				return
+			self._last = now
+
+		print(self._line(s))
+
+	def close(self):
+		"""
+		print the final line with the elapsed time
+		"""
+		s = self.metrics.progress[self.stage] = self._state()
+
+		print(f'{self.stage}: done {self.done_} in {Progress._fmt(s["elapsed"])} ({s["per_sec"] or 0:.1f}/sec)')
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, *exc):
+
+		self.close()
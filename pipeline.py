@@ -0,0 +1,399 @@
+import argparse
+import ast
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+"""
+the artist pipeline as a DAG of stages; every stage declares the files it reads and writes and a stage
+only runs again if any of its inputs or its code changed since the last run (or an output is missing);
+stages that don't depend on each other run in parallel and the enrichment branches are joined by the
+merge stage into data/artists_all.json
+
+	python pipeline.py status
+	python pipeline.py run [stage ..] [--force] [--jobs 4] [--refresh] [--profile [RUN_ID]]
+"""
+
+DATA_DIR = 'data'
+MANIFEST = f'{DATA_DIR}/pipeline.json'
+
+# where the modules are
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+	"""
+	a pipeline stage calling Artist method with kwargs; the first input is the artist file to load
+	(unless create_new) and if save is True the artists are saved to the first output afterwards;
+	modules are modules the stage depends on that its code doesn't name (see stage_code)
+	"""
+	def __init__(self, name, method, inputs=(), outputs=(), kwargs=None, modules=(), load=True, create_new=False, save=True):
+
+		self.name = name
+		self.method = method
+		self.inputs = list(inputs)
+		self.outputs = list(outputs)
+		self.kwargs = kwargs or {}
+		self.modules = list(modules)
+		self.load = load
+		self.create_new = create_new
+		self.save = save
+
+	def code_hash(self):
+		"""
+		hash of the stage method, its arguments and the code it depends on (see stage_code); a change to
+		a helper or module the stage uses makes it rerun, a change to code only other stages use doesn't
+		"""
+		sources, modules = stage_code(self.method)
+
+		h = hashlib.sha256(self.method.encode())
+		h.update(json.dumps(self.kwargs, sort_keys=True).encode())
+
+		for src in sources:
+			h.update(src.encode())
+
+		for m in sorted(local_imports(modules | set(self.modules))):
+			h.update(file_hash(f'{CODE_DIR}/{m}.py').encode())
+
+		return h.hexdigest()
+
+	def refreshable(self):
+		"""
+		if the stage method can refresh only the artists that are due (see refresh.py)
+		"""
+		from artists import Artist
+
+		return 'refresh' in inspect.signature(getattr(Artist, self.method)).parameters
+
+
+STAGES = [Stage('normalize', 'normalize_all', ['artists.json'], ['artists_n.json']),
+			Stage('dedup', 'drop_unpopular', ['artists_n.json'], ['artists_d.json'], load=False),
+			Stage('songkick', 'add_songkick_id', ['artists_d.json'], ['artists_sk.json']),
+			Stage('gigs', 'add_gigs', ['artists_sk.json'], ['artists_gig.json']),
+			Stage('gig_table', 'build_gig_table', ['artists_gig.json'], ['gigs/meta.json', 'data_atists_aus_gigs.txt'],
+					save=False),
+			Stage('soundcloud', 'get_soundcloud', ['artists_sk.json'], ['artists_sc.json']),
+			Stage('discogs', 'get_discogs', ['discogs_20180401_artists.xml'], ['discogs_.jsonl'], kwargs={'out_file': 'discogs_.jsonl'},
+					create_new=True, save=False),
+			Stage('match_discogs', 'match_discogs', ['artists_d.json', 'discogs_.jsonl'], ['artists_dg.json'],
+					kwargs={'file_': 'discogs_.jsonl'}),
+			Stage('social', 'refresh_social', ['artists_dg.json'], ['artists_social.json']),
+			# everything the branches above found in one catalogue
+			Stage('merge', 'merge_enrichment', ['artists_d.json', 'artists_gig.json', 'artists_sc.json', 'artists_social.json'],
+					['artists_all.json'], kwargs={'files_': ['artists_gig.json', 'artists_sc.json', 'artists_social.json']})]
+
+def file_hash(path, chunk_size=1 << 20):
+	"""
+	sha256 of the content of file path or None if there's no such file
+	"""
+	if not os.path.exists(path):
+		return None
+
+	h = hashlib.sha256()
+
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(chunk_size), b''):
+			h.update(chunk)
+
+	return h.hexdigest()
+
+def local_imports(modules):
+	"""
+	returns the set of modules (by name) from modules and every module in CODE_DIR they import, directly
+	or not, at the top or inside functions
+	"""
+	seen = set()
+	todo_ = list(modules)
+
+	while todo_:
+
+		m = todo_.pop()
+
+		if (m in seen) or not os.path.exists(f'{CODE_DIR}/{m}.py'):
+			continue
+
+		seen.add(m)
+
+		for node in ast.walk(ast.parse(open(f'{CODE_DIR}/{m}.py').read())):
+			if isinstance(node, ast.Import):
+				todo_.extend(a.name.split('.')[0] for a in node.names)
+			elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+				todo_.append(node.module.split('.')[0])
+
+	return seen
+
+def stage_code(method):
+	"""
+	returns the sources of Artist method and of every Artist method or property it uses, directly or not (plus
+	artists and save as every stage loads and saves artists), in the order they were found and the set of local
+	modules these use; the modules they import count too (see local_imports)
+	"""
+	src = open(f'{CODE_DIR}/artists.py').read()
+	tree = ast.parse(src)
+
+	# names imported at the top of artists: name -> module
+	imported = {}
+
+	for node in tree.body:
+		if isinstance(node, ast.Import):
+			imported.update({(a.asname or a.name).split('.')[0]: a.name.split('.')[0] for a in node.names})
+		elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+			imported.update({a.asname or a.name: node.module.split('.')[0] for a in node.names})
+
+	cls = next(n for n in tree.body if isinstance(n, ast.ClassDef) and n.name == 'Artist')
+	members = {n.name: n for n in cls.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))}
+
+	sources = []
+	modules = set()
+	seen = set()
+	todo_ = [method, 'artists', 'save']
+
+	while todo_:
+
+		m = todo_.pop(0)
+
+		if (m in seen) or (m not in members):
+			continue
+
+		seen.add(m)
+		sources.append(ast.get_source_segment(src, members[m]))
+
+		for node in ast.walk(members[m]):
+			if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in ('self', 'Artist'):
+				todo_.append(node.attr)
+			elif isinstance(node, ast.Name) and node.id in imported:
+				modules.add(imported[node.id])
+			elif isinstance(node, ast.Import):
+				modules.update(a.name.split('.')[0] for a in node.names)
+			elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+				modules.add(node.module.split('.')[0])
+
+	return sources, {m for m in modules if os.path.exists(f'{CODE_DIR}/{m}.py')}
+
+def count_records(path):
+	"""
+	how many artists are in file path; line-delimited files are only counted, not parsed
+	"""
+	from store import read_artists
+
+	if path.endswith('.jsonl'):
+		with open(path, 'rb') as f:
+			return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+
+	return sum(1 for _ in read_artists(path))
+
+def load_manifest():
+
+	return json.load(open(MANIFEST)) if os.path.exists(MANIFEST) else {}
+
+def is_stale(stage, manifest):
+	"""
+	returns the reason why stage has to run or None if it's up to date
+	"""
+	done = manifest.get(stage.name, None)
+
+	if done is None:
+		return 'never ran'
+
+	if done['code'] != stage.code_hash():
+		return 'code changed'
+
+	for f in stage.inputs:
+		if done['inputs'].get(f) != file_hash(f'{DATA_DIR}/{f}'):
+			return f'{f} changed'
+
+	for f in stage.outputs:
+		if done['outputs'].get(f) != file_hash(f'{DATA_DIR}/{f}'):
+			return f'{f} is missing or changed'
+
+	return None
+
+def run_stage(stage, refresh=False, profile=None):
+	"""
+	run stage (in a process of its own) and return what goes into the manifest; with refresh=True a stage
+	that can refresh incrementally only fetches the artists that are due; with a run id for profile the stage
+	is profiled (see profiling)
+	"""
+	from artists import Artist
+	from metrics import REGISTRY as metrics
+
+	inputs = {f: file_hash(f'{DATA_DIR}/{f}') for f in stage.inputs}
+
+	# so that a long stage can be watched while it's running
+	metrics_file = f'{DATA_DIR}/metrics_{stage.name}.json'
+	metrics.autodump(metrics_file)
+
+	t0 = time.time()
+
+	refresh = refresh and stage.refreshable()
+
+	# a refresh starts from what the stage got last time and only fetches the artists that are due
+	art = Artist(create_new=stage.create_new, artist_file=None if stage.create_new else stage.inputs[0], load=stage.load, profile=profile,
+					previous=stage.outputs[0] if refresh else None)
+	getattr(art, stage.method)(**stage.kwargs, **({'refresh': True} if refresh else {}))
+
+	if stage.save:
+		art.save(stage.outputs[0])
+
+	wall = time.time() - t0
+
+	records = len(art.artists) or count_records(f'{DATA_DIR}/{stage.outputs[0]}')
+
+	metrics.dump(metrics_file)
+
+	return {'code': stage.code_hash(), 'inputs': inputs,
+			'outputs': {f: file_hash(f'{DATA_DIR}/{f}') for f in stage.outputs},
+			'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+			'wall_time': round(wall, 3),
+			'records': records,
+			'records_per_sec': round(records/wall, 1) if wall else None,
+			# on Linux ru_maxrss is in kilobytes
+			'peak_memory_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1),
+			'counters': metrics.snapshot()['counters'],
+			'profile': profile}
+
+def _run_stage(name, refresh=False, profile=None):
+
+	return run_stage(next(s for s in STAGES if s.name == name), refresh, profile)
+
+def upstream(stages):
+	"""
+	returns a dictionary {stage name: set of names of stages producing its inputs}
+	"""
+	producers = {f: s.name for s in stages for f in s.outputs}
+
+	return {s.name: {producers[f] for f in s.inputs if f in producers} for s in stages}
+
+def run(names=None, force=False, jobs=1, refresh=False, profile=None):
+	"""
+	run stages names (all if None) and whatever stages they need that aren't up to date; a stage reruns if
+	anything upstream reran; up to jobs stages run at the same time, each in a fresh process; with refresh=True
+	the stages that can refresh incrementally run anyway but only fetch the artists that are due; with profile
+	(a run id or True, or the ARTISTS_PROFILE environment variable set) every stage that runs is profiled
+	"""
+	from profiling import run_id_from
+
+	# the same run id for all stages, whatever process they run in
+	profile = run_id_from(profile)
+
+	if profile:
+		print(f'profiling run {profile}')
+
+	deps = upstream(STAGES)
+	stages = {s.name: s for s in STAGES}
+
+	# the stages asked for and everything they depend on
+	wanted = set()
+	todo_ = list(names or stages)
+
+	while todo_:
+		n = todo_.pop()
+		if n not in stages:
+			raise ValueError(f'there\'s no stage {n}!')
+		if n not in wanted:
+			wanted.add(n)
+			todo_.extend(deps[n])
+
+	manifest = load_manifest()
+	forced = set(names or stages) if force else set()
+	rerun = set()
+	failed = set()
+	pending = [n for n in stages if n in wanted]
+	running = {}
+
+	# the process for each stage is fresh so that its peak memory is its own
+	ctx = multiprocessing.get_context('spawn')
+
+	with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx, max_tasks_per_child=1) as pool:
+
+		while pending or running:
+
+			for n in list(pending):
+
+				if deps[n] & (set(pending) | set(running.values())):
+					continue
+
+				pending.remove(n)
+
+				if deps[n] & failed:
+					print(f'{n}: skipped because an upstream stage failed')
+					failed.add(n)
+					continue
+
+				reason = 'forced' if n in forced else ('upstream reran' if deps[n] & rerun else is_stale(stages[n], manifest))
+
+				if (reason is None) and refresh and stages[n].refreshable():
+					reason = 'refresh'
+
+				if reason is None:
+					print(f'{n}: up to date')
+					continue
+
+				print(f'{n}: running ({reason})...')
+				running[pool.submit(_run_stage, n, refresh, profile)] = n
+
+			if not running:
+				continue
+
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+			for fut in done:
+
+				n = running.pop(fut)
+
+				try:
+					manifest[n] = fut.result()
+				except Exception as e:
+					print(f'{n}: failed! {e!r}')
+					failed.add(n)
+					continue
+
+				rerun.add(n)
+
+				with open(MANIFEST, 'w') as f:
+					json.dump(manifest, f, indent=4)
+
+				m = manifest[n]
+				print(f'{n}: done in {m["wall_time"]:.1f} sec, {m["records"]} records ({m["records_per_sec"]}/sec), peak memory {m["peak_memory_mb"]} MB')
+
+	return manifest
+
+def status():
+
+	manifest = load_manifest()
+
+	for s in STAGES:
+		reason = is_stale(s, manifest)
+		m = manifest.get(s.name, {})
+		print(f'{s.name:15} {"up to date" if reason is None else reason:30} {m.get("finished", "")} {m.get("wall_time", "")}')
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description='run the artist pipeline')
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	sub.add_parser('status', help='show which stages are up to date')
+
+	p = sub.add_parser('run', help='run stages that are out of date')
+	p.add_argument('stages', nargs='*', help='stages to run (with everything they need); all by default')
+	p.add_argument('--force', action='store_true', help='run the given stages (all if none given) even if they are up to date')
+	p.add_argument('--jobs', type=int, default=1, help='how many stages may run at the same time')
+	p.add_argument('--refresh', action='store_true', help='only fetch artists that are new, failed or stale in the stages that can')
+	p.add_argument('--profile', nargs='?', const=True, default=None, metavar='RUN_ID',
+					help='save a cProfile dump and the top allocations of every stage to data/profiles/RUN_ID (a new run id by default)')
+
+	args = parser.parse_args(argv)
+
+	if args.command == 'status':
+		status()
+	else:
+		run(args.stages or None, force=args.force, jobs=args.jobs, refresh=args.refresh, profile=args.profile)
+
+if __name__ == '__main__':
+
+	main()
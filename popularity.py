@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import pickle
+from itertools import product
+
+class PopularityIndex:
+	"""
+	all popularity reference lists in one dictionary so that a single lookup returns every
+	popularity flag for a (normalized) artist name
+	"""
+	FLAGS = 'is_goldplatinum is_billboard is_rollingstone gigs_in_aus'.split()
+
+	# flag values for every possible combination of flags; a name is stored with a bit mask
+	# and the mask is the position of its flag values in this list
+	FLAG_VALUES = [tuple(reversed(yn)) for yn in product('ny', repeat=len(FLAGS))]
+
+	def __init__(self, lists=None, award_winners=None):
+		"""
+		lists is a dictionary like {'is_goldplatinum': [normalized names], ..}, award_winners
+		is a dictionary {normalized name: list of awards}
+		"""
+		self.masks = {}
+
+		for bit, flag in enumerate(PopularityIndex.FLAGS):
+			for name in (lists or {}).get(flag, ()):
+				self.masks[name] = self.masks.get(name, 0) | (1 << bit)
+
+		self.award_winners = dict(award_winners or {})
+
+	def __len__(self):
+
+		return len(self.masks.keys() | self.award_winners.keys())
+
+	def __contains__(self, name):
+
+		return (name in self.masks) or (name in self.award_winners)
+
+	def lookup(self, name):
+		"""
+		returns a dictionary with all popularity flags and awards for name
+		"""
+		inf_ = dict(zip(PopularityIndex.FLAGS, PopularityIndex.FLAG_VALUES[self.masks.get(name, 0)]))
+		inf_['awards'] = self.award_winners.get(name, None)
+
+		return inf_
+
+	def lookup_many(self, names):
+		"""
+		returns a list of dictionaries with popularity flags and awards, one for each name in names
+		"""
+		masks = self.masks.get
+		awards = self.award_winners.get
+		flags = PopularityIndex.FLAGS
+		flag_values = PopularityIndex.FLAG_VALUES
+
+		res = []
+
+		for name in names:
+			inf_ = dict(zip(flags, flag_values[masks(name, 0)]))
+			inf_['awards'] = awards(name, None)
+			res.append(inf_)
+
+		return res
+
+# reference files in the data directory the popularity index is built from
+REFERENCE_FILES = {'is_goldplatinum': 'goldplatinum-artists.txt',
+					'is_billboard': 'billboard_artists.txt',
+					'is_rollingstone': 'rollingstone.txt',
+					'gigs_in_aus': 'data_atists_aus_gigs.txt'}
+AWARD_FILE = 'award_winners.json'
+SNAPSHOT_FILE = 'popularity.snapshot'
+
+def _file_hash(path):
+
+	h = hashlib.sha256()
+
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			h.update(chunk)
+
+	return h.hexdigest()
+
+def snapshot_key(data_dir, normaliser):
+	"""
+	what a snapshot depends on: the hashes of the reference files and of the normaliser code
+	"""
+	import artistnormaliser
+
+	key_ = {f: _file_hash(f'{data_dir}/{f}') for f in sorted(REFERENCE_FILES.values()) + [AWARD_FILE]}
+	key_['normaliser'] = f'{normaliser.__module__}.{normaliser.__qualname__}:{_file_hash(artistnormaliser.__file__)}'
+
+	return key_
+
+def build_snapshot(data_dir, normaliser, normalise_many=None, path=None):
+	"""
+	normalize the reference files in data_dir and save the resulting index to the snapshot file; normalise_many
+	(a function taking a list of names and returning a list of normalized names, by default normaliser applied
+	to every name) may normalize in parallel but has to do what normaliser does; returns the index
+	"""
+	normalise_many = normalise_many or (lambda names: [normaliser(n) for n in names])
+	key_ = snapshot_key(data_dir, normaliser)
+
+	lists = {}
+
+	for flag, f in REFERENCE_FILES.items():
+		with open(f'{data_dir}/{f}') as f_:
+			lists[flag] = normalise_many([l.strip() for l in f_ if l.strip()])
+
+	award_winners = json.load(open(f'{data_dir}/{AWARD_FILE}'))
+	award_winners = dict(zip(normalise_many(list(award_winners)), award_winners.values()))
+
+	index = PopularityIndex(lists, award_winners)
+
+	path = path or f'{data_dir}/{SNAPSHOT_FILE}'
+
+	# the key goes first so that checking if a snapshot is stale doesn't need to load the rest
+	with open(f'{path}.part', 'wb') as f:
+		pickle.dump(key_, f, protocol=pickle.HIGHEST_PROTOCOL)
+		pickle.dump((index.masks, index.award_winners), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+	os.replace(f'{path}.part', path)
+
+	print(f'saved popularity snapshot with {len(index)} names to {path}')
+
+	return index
+
+def load_snapshot(data_dir, normaliser, normalise_many=None, path=None):
+	"""
+	returns the popularity index from the snapshot file; the snapshot is (re)built first if it's missing or any
+	reference file or the normaliser changed since it was built; loading a snapshot is one unpickling, no names
+	need to be normalized
+	"""
+	path = path or f'{data_dir}/{SNAPSHOT_FILE}'
+	key_ = snapshot_key(data_dir, normaliser)
+
+	if os.path.exists(path):
+		with open(path, 'rb') as f:
+			if pickle.load(f) == key_:
+				index = PopularityIndex()
+				index.masks, index.award_winners = pickle.load(f)
+				return index
+
+	return build_snapshot(data_dir, normaliser, normalise_many, path)
+
+def most_popular(artists, stats=None):
+	"""
+	one pass over artists (any iterable, e.g. a generator reading a file) that finds the artists to keep:
+	not those with zero popularity and only the most popular artist for every name (the first one if there's
+	a tie); returns a bytearray with 1 for every artist (by position) to keep; only the popularity and
+	position of the best artist so far are kept for every name; if stats is a dictionary, it gets the counts
+	of what was seen and removed
+	"""
+	best = {}
+	ambiguous = set()
+
+	seen = unpopular = 0
+
+	for i, rc in enumerate(artists):
+
+		seen += 1
+
+		if rc['popularity'] <= 0:
+			unpopular += 1
+			continue
+
+		name_ = rc['name']
+		kept = best.get(name_, None)
+
+		if kept is None:
+			best[name_] = (rc['popularity'], i)
+		else:
+			ambiguous.add(name_)
+			if kept[0] < rc['popularity']:
+				best[name_] = (rc['popularity'], i)
+
+	if stats is not None:
+		stats.update({'seen': seen, 'unpopular': unpopular, 'ambiguous_names': len(ambiguous),
+						'duplicates': seen - unpopular - len(best), 'kept': len(best)})
+
+	keep = bytearray(seen)
+
+	for _, i in best.values():
+		keep[i] = 1
+
+	return keep
+
+def keep_most_popular(artists, stats=None):
+	"""
+	yields the artists most_popular keeps, in their original order; artists is a function returning a fresh
+	iterable of the same artists every time (like lambda: read_artists(path)) or a list, as it's gone through
+	twice: once to find the artists to keep and once more to yield them, so no artist is held on to
+	"""
+	source = artists if callable(artists) else (lambda: artists)
+
+	keep = most_popular(source(), stats)
+
+	for i, rc in enumerate(source()):
+		if keep[i]:
+			yield rc
+
+if __name__ == '__main__':
+
+	import sys
+	from artistnormaliser import normalise_name, normalize_many
+
+	# rebuild the snapshot for the data directory (data by default) with the names normalized the Artist way
+	build_snapshot(sys.argv[1] if len(sys.argv) > 1 else 'data', normalise_name,
+					lambda names: normalize_many(names, workers=None, normaliser=normalise_name))
@@ -0,0 +1,263 @@
+import argparse
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+"""
+opt-in profiling of Artist stage methods: with ARTISTS_PROFILE=1 in the environment (or Artist(profile=True),
+or python pipeline.py run --profile) every stage method that's called is run under cProfile and tracemalloc
+and for each one data/profiles/<run id>/ gets
+
+	<method>.prof			the cProfile dump (python -m pstats, snakeviz etc.)
+	<method>_memory.txt		the lines that allocated the most memory that was still held at the end
+	<method>.json			wall time, peak traced memory and the top functions and allocations
+
+ARTISTS_PROFILE can also be a run id; otherwise the run id is the time the run started; to see which functions
+got slower or hungrier between two runs (the last two by default)
+
+	python profiling.py compare [run_a run_b]
+"""
+
+ENV = 'ARTISTS_PROFILE'
+PROFILE_DIR = 'data/profiles'
+
+def new_run_id():
+
+	return time.strftime('%Y%m%d-%H%M%S')
+
+def run_id_from(profile=None):
+	"""
+	the run id for profile (a run id or True) or, if that's None, for the ARTISTS_PROFILE environment
+	variable; returns None if profiling is off
+	"""
+	if profile is None:
+		profile = os.environ.get(ENV, None)
+
+	if profile in (None, False, '', '0'):
+		return None
+
+	if profile in (True, '1'):
+		return new_run_id()
+
+	return str(profile)
+
+def _func_name(key_):
+	"""
+	pstats key (file, line, function) as file:line(function)
+	"""
+	file_, line, func = key_
+
+	return f'{func}' if file_ == '~' else f'{file_}:{line}({func})'
+
+
+class Profiler:
+	"""
+	writes a profile to dir_/run_id for every stage run with stage(name); only the outermost stage is profiled
+	when stages call one another (like get_facebook_likes calling refresh_social)
+	"""
+	def __init__(self, run_id=None, dir_=PROFILE_DIR, top=30):
+
+		self.run_id = run_id or new_run_id()
+		self.dir = f'{dir_}/{self.run_id}'
+		self.top = top
+		self._active = False
+
+	def _path(self, name):
+		"""
+		path (without extension) for the profile of stage name; a stage run again in the same run gets _2, _3..
+		"""
+		path = f'{self.dir}/{name}'
+		n = 1
+
+		while os.path.exists(f'{path}.json'):
+			n += 1
+			path = f'{self.dir}/{name}_{n}'
+
+		return path
+
+	@contextmanager
+	def stage(self, name):
+
+		if self._active:
+			yield
+			return
+
+		self._active = True
+		tracing = tracemalloc.is_tracing()
+
+		if not tracing:
+			tracemalloc.start()
+		tracemalloc.reset_peak()
+
+		prof = cProfile.Profile()
+		t0 = time.time()
+		prof.enable()
+
+		try:
+			yield
+		finally:
+			prof.disable()
+			wall = time.time() - t0
+			snapshot = tracemalloc.take_snapshot()
+			peak = tracemalloc.get_traced_memory()[1]
+
+			if not tracing:
+				tracemalloc.stop()
+
+			self._active = False
+			self._save(name, prof, snapshot, wall, peak)
+
+	def _save(self, name, prof, snapshot, wall, peak):
+
+		os.makedirs(self.dir, exist_ok=True)
+
+		path = self._path(name)
+
+		prof.dump_stats(f'{path}.prof')
+
+		# allocations by tracemalloc itself and by the profiler aren't the stage's
+		snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+											tracemalloc.Filter(False, __file__)])
+		allocs = snapshot.statistics('lineno')[:self.top]
+
+		with open(f'{path}_memory.txt', 'w') as f:
+			for s in allocs:
+				f.write(f'{s}\n')
+
+		stats = pstats.Stats(prof).stats
+		functions = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)[:self.top]
+
+		summary = {'stage': name, 'run_id': self.run_id,
+					'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+					'wall_time': round(wall, 3),
+					'peak_traced_mb': round(peak/2**20, 1),
+					'functions': [{'function': _func_name(k), 'calls': nc, 'tottime': round(tt, 4), 'cumtime': round(ct, 4)}
+									for k, (cc, nc, tt, ct, callers) in functions],
+					'allocations': [{'line': str(s.traceback), 'kb': round(s.size/1024, 1), 'count': s.count} for s in allocs]}
+
+		with open(f'{path}.json', 'w') as f:
+			json.dump(summary, f, indent=4)
+
+		print(f'{name}: profile saved to {path}.prof ({wall:.1f} sec, peak traced memory {summary["peak_traced_mb"]} MB)')
+
+	def wrap(self, obj, names):
+		"""
+		profile every call of the methods names of obj
+		"""
+		for n in names:
+
+			method = getattr(obj, n)
+
+			@functools.wraps(method)
+			def _profiled(*args, _method=method, _name=n, **kwargs):
+				with self.stage(_name):
+					return _method(*args, **kwargs)
+
+			setattr(obj, n, _profiled)
+
+		return obj
+
+# comparing runs
+
+def runs(dir_=PROFILE_DIR):
+	"""
+	run ids with profiles, oldest first
+	"""
+	if not os.path.isdir(dir_):
+		return []
+
+	return sorted((r for r in os.listdir(dir_) if os.path.isdir(f'{dir_}/{r}')), key=lambda r: os.path.getmtime(f'{dir_}/{r}'))
+
+def _function_times(path):
+	"""
+	{function: (calls, tottime, cumtime)} from cProfile dump path
+	"""
+	return {_func_name(k): (nc, tt, ct) for k, (cc, nc, tt, ct, callers) in pstats.Stats(path).stats.items()}
+
+def compare(run_a, run_b, dir_=PROFILE_DIR, top=10, min_change=0.01):
+	"""
+	returns a list of lines summarizing what changed from run_a to run_b for every stage profiled in both:
+	wall time, peak traced memory and the functions whose own time (tottime) changed most (by at least
+	min_change seconds)
+	"""
+	lines = []
+	stages = sorted(set(f[:-5] for f in os.listdir(f'{dir_}/{run_a}') if f.endswith('.json')) &
+					set(f[:-5] for f in os.listdir(f'{dir_}/{run_b}') if f.endswith('.json')))
+
+	if not stages:
+		return [f'no stages were profiled in both {run_a} and {run_b}']
+
+	for s in stages:
+
+		a = json.load(open(f'{dir_}/{run_a}/{s}.json'))
+		b = json.load(open(f'{dir_}/{run_b}/{s}.json'))
+
+		change = f' ({(b["wall_time"] - a["wall_time"])/a["wall_time"]:+.0%})' if a['wall_time'] else ''
+		lines.append(f'{s}: {a["wall_time"]:.2f} -> {b["wall_time"]:.2f} sec{change}, '
+						f'peak traced memory {a["peak_traced_mb"]} -> {b["peak_traced_mb"]} MB')
+
+		fa = _function_times(f'{dir_}/{run_a}/{s}.prof')
+		fb = _function_times(f'{dir_}/{run_b}/{s}.prof')
+
+		deltas = []
+
+		for f in set(fa) | set(fb):
+			na, ta, _ = fa.get(f, (0, 0., 0.))
+			nb, tb, _ = fb.get(f, (0, 0., 0.))
+			if abs(tb - ta) >= min_change:
+				deltas.append((tb - ta, f, ta, tb, na, nb))
+
+		for d, f, ta, tb, na, nb in sorted(deltas, key=lambda x: abs(x[0]), reverse=True)[:top]:
+			calls = f', calls {na} -> {nb}' if na != nb else ''
+			lines.append(f'\t{d:+.3f} sec  {f}  ({ta:.3f} -> {tb:.3f} sec{calls})')
+
+		ma = {x['line']: x['kb'] for x in a['allocations']}
+		mb = {x['line']: x['kb'] for x in b['allocations']}
+
+		for l in sorted(set(ma) | set(mb), key=lambda l: abs(mb.get(l, 0) - ma.get(l, 0)), reverse=True)[:3]:
+			if abs(mb.get(l, 0) - ma.get(l, 0)) >= 1024:
+				lines.append(f'\t{(mb.get(l, 0) - ma.get(l, 0))/1024:+.1f} MB  {l}')
+
+	return lines
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description='compare profiles of stage runs')
+	parser.add_argument('--dir', default=PROFILE_DIR, help='where the profiles are')
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	sub.add_parser('runs', help='list the runs with profiles')
+
+	p = sub.add_parser('compare', help='show what got slower or needs more memory from one run to another')
+	p.add_argument('runs', nargs='*', help='the two run ids to compare; the last two runs by default')
+	p.add_argument('--top', type=int, default=10, help='how many functions to show for every stage')
+
+	args = parser.parse_args(argv)
+
+	if args.command == 'runs':
+		for r in runs(args.dir):
+			print(r)
+		return 0
+
+	run_ids = args.runs or runs(args.dir)[-2:]
+
+	if len(run_ids) != 2:
+		print('need two runs to compare!')
+		return 1
+
+	print(f'{run_ids[0]} -> {run_ids[1]}')
+
+	for l in compare(*run_ids, dir_=args.dir, top=args.top):
+		print(l)
+
+	return 0
+
+if __name__ == '__main__':
+
+	sys.exit(main())
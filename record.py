@@ -0,0 +1,312 @@
+import json
+import sys
+
+"""
+compact artist records: an artist as a full Spotify dictionary (with nested dictionaries for followers and
+external URLs, a list of images etc.) plus whatever enrichment adds costs a couple of kilobytes; an ArtistRecord
+keeps the fields the pipeline uses in slots, drops what can be rebuilt from the Spotify id and packs anything
+else into a single JSON string, so it converts back to exactly the same dictionary
+"""
+
+SPOTIFY_API = 'https://api.spotify.com/v1/artists/'
+SPOTIFY_WEB = 'https://open.spotify.com/artist/'
+SPOTIFY_IMAGES = 'https://i.scdn.co/image/'
+
+_MISSING = object()
+
+
+class ArtistRecord:
+	"""
+	an artist that behaves like the dictionary it came from (rc['name'], rc.get('id_sk'), rc.update(..) etc.
+	all work) at a fraction of the memory
+	"""
+	# what the pipeline reads or adds; anything else goes to _rest
+	FIELDS = ('id', 'name', 'popularity', 'genres', 'id_sk', 'id_sc', 'id_dg', 'media', 'gigs', 'country', 'city',
+				'followers_soundcloud', 'url_sc', 'website', 'facebook_likes', 'twitter_followers', 'fetched')
+
+	__slots__ = FIELDS + ('_followers', '_images', '_flags', '_rest', '_keys')
+
+	# flags for the Spotify fields we don't keep because they can be rebuilt from the id
+	_HREF, _URI, _URLS, _TYPE = 1, 2, 4, 8
+
+	# the orders of keys records came with; there are only so many so records with the same order share a tuple
+	_ORDERS = {}
+
+	def __init__(self, **fields):
+
+		self._flags = 0
+		self._rest = None
+		self._keys = ()
+
+		for k, v in fields.items():
+			self[k] = v
+
+	@classmethod
+	def from_dict(cls, rc):
+
+		r = cls.__new__(cls)
+		r._flags = 0
+		r._rest = None
+		r._keys = _order(tuple(rc))
+
+		id_ = rc.get('id', None)
+		rest = {}
+
+		for k, v in rc.items():
+
+			if k in ArtistRecord.FIELDS:
+				if k == 'genres' and isinstance(v, list):
+					# there are only so many genres
+					v = [sys.intern(g) if isinstance(g, str) else g for g in v]
+				elif k in ('country', 'city') and isinstance(v, str):
+					v = sys.intern(v)
+				setattr(r, k, v)
+			elif (k == 'followers') and isinstance(v, dict) and (v.keys() == {'href', 'total'}) and (v['href'] is None) and isinstance(v['total'], int):
+				r._followers = v['total']
+			elif (k == 'images') and (_pack_images(v) is not None):
+				r._images = _pack_images(v)
+			elif (k == 'href') and (id_ is not None) and (v == f'{SPOTIFY_API}{id_}'):
+				r._flags |= ArtistRecord._HREF
+			elif (k == 'uri') and (id_ is not None) and (v == f'spotify:artist:{id_}'):
+				r._flags |= ArtistRecord._URI
+			elif (k == 'external_urls') and (id_ is not None) and (v == {'spotify': f'{SPOTIFY_WEB}{id_}'}):
+				r._flags |= ArtistRecord._URLS
+			elif (k == 'type') and (v == 'artist'):
+				r._flags |= ArtistRecord._TYPE
+			else:
+				rest[k] = v
+
+		if rest:
+			r._rest = json.dumps(rest, separators=(',', ':'))
+
+		return r
+
+	def _rebuilt(self, k):
+		"""
+		value of key k that isn't stored as is or _MISSING
+		"""
+		if k == 'followers':
+			f = getattr(self, '_followers', _MISSING)
+			return _MISSING if f is _MISSING else {'href': None, 'total': f}
+
+		if k == 'images':
+			b = getattr(self, '_images', _MISSING)
+			return _MISSING if b is _MISSING else _unpack_images(b)
+
+		id_ = getattr(self, 'id', None)
+
+		if (k == 'href') and (self._flags & ArtistRecord._HREF):
+			return f'{SPOTIFY_API}{id_}'
+		if (k == 'uri') and (self._flags & ArtistRecord._URI):
+			return f'spotify:artist:{id_}'
+		if (k == 'external_urls') and (self._flags & ArtistRecord._URLS):
+			return {'spotify': f'{SPOTIFY_WEB}{id_}'}
+		if (k == 'type') and (self._flags & ArtistRecord._TYPE):
+			return 'artist'
+
+		if self._rest is not None:
+			return json.loads(self._rest).get(k, _MISSING)
+
+		return _MISSING
+
+	def _get(self, k):
+
+		if k in ArtistRecord.FIELDS:
+			return getattr(self, k, _MISSING)
+
+		return self._rebuilt(k)
+
+	def to_dict(self):
+		"""
+		the artist as the dictionary it came from
+		"""
+		rest = json.loads(self._rest) if self._rest is not None else {}
+
+		return {k: rest[k] if k in rest else self._get(k) for k in self._keys}
+
+	# the dictionary interface the pipeline uses
+
+	def __getitem__(self, k):
+
+		v = self._get(k)
+
+		if v is _MISSING:
+			raise KeyError(k)
+
+		return v
+
+	def get(self, k, default=None):
+
+		v = self._get(k)
+
+		return default if v is _MISSING else v
+
+	def __contains__(self, k):
+
+		return self._get(k) is not _MISSING
+
+	def _replace(self, rc):
+		"""
+		make this record hold dictionary rc
+		"""
+		r = ArtistRecord.from_dict(rc)
+
+		for s in ArtistRecord.__slots__:
+			if hasattr(self, s):
+				delattr(self, s)
+			if hasattr(r, s):
+				setattr(self, s, getattr(r, s))
+
+	def __setitem__(self, k, v):
+
+		# the id is what the dropped Spotify fields are rebuilt from
+		if (k in ArtistRecord.FIELDS) and not ((k == 'id') and self._flags):
+			if not hasattr(self, k):
+				self._keys = _order(self._keys + (k,))
+			setattr(self, k, v)
+			return
+
+		# rarely happens so the record is simply rebuilt
+		rc = self.to_dict()
+		rc[k] = v
+		self._replace(rc)
+
+	def update(self, fields=(), **kwargs):
+
+		for k, v in dict(fields, **kwargs).items():
+			self[k] = v
+
+	def pop(self, k, *default):
+
+		v = self._get(k)
+
+		if v is _MISSING:
+			if default:
+				return default[0]
+			raise KeyError(k)
+
+		if (k in ArtistRecord.FIELDS) and not ((k == 'id') and self._flags):
+			delattr(self, k)
+			self._keys = _order(tuple(k_ for k_ in self._keys if k_ != k))
+		else:
+			rc = self.to_dict()
+			del rc[k]
+			self._replace(rc)
+
+		return v
+
+	def keys(self):
+
+		return self.to_dict().keys()
+
+	def items(self):
+
+		return self.to_dict().items()
+
+	def __iter__(self):
+
+		return iter(self.to_dict())
+
+	def __len__(self):
+
+		return len(self.to_dict())
+
+	def __eq__(self, other):
+
+		if isinstance(other, ArtistRecord):
+			other = other.to_dict()
+
+		return self.to_dict() == other
+
+	def __repr__(self):
+
+		return f'ArtistRecord({self.to_dict()!r})'
+
+	def __getstate__(self):
+
+		return self.to_dict()
+
+	def __setstate__(self, rc):
+
+		self._replace(rc)
+
+def _order(keys):
+	"""
+	the shared tuple for the order of keys keys (unless there are suspiciously many orders already)
+	"""
+	order = ArtistRecord._ORDERS.get(keys, None)
+
+	if order is None:
+		if len(ArtistRecord._ORDERS) >= (1 << 16):
+			return keys
+		order = ArtistRecord._ORDERS[keys] = keys
+
+	return order
+
+def _pack_images(images):
+	"""
+	Spotify images (a list like [{'height': 640, 'url': 'https://i.scdn.co/image/<hex>', 'width': 640}, ..])
+	packed into bytes: height, width (2 bytes each), hash length (1 byte) and the hash itself for every image;
+	returns None for anything that doesn't look exactly like that
+	"""
+	if not isinstance(images, list):
+		return None
+
+	b = bytearray()
+
+	for im in images:
+
+		if not isinstance(im, dict) or (list(im) != ['height', 'url', 'width']):
+			return None
+
+		h, url, w = im['height'], im['url'], im['width']
+
+		if not (isinstance(h, int) and isinstance(w, int) and (0 <= h < 0xffff) and (0 <= w < 0xffff)):
+			return None
+
+		if not (isinstance(url, str) and url.startswith(SPOTIFY_IMAGES)):
+			return None
+
+		hash_ = url[len(SPOTIFY_IMAGES):]
+
+		try:
+			hb = bytes.fromhex(hash_)
+		except ValueError:
+			return None
+
+		# upper case or odd length hashes wouldn't come back the same
+		if (hb.hex() != hash_) or (len(hb) > 0xff):
+			return None
+
+		b += h.to_bytes(2, 'big') + w.to_bytes(2, 'big') + bytes([len(hb)]) + hb
+
+	return bytes(b)
+
+def _unpack_images(b):
+
+	images = []
+	i = 0
+
+	while i < len(b):
+		n = b[i + 4]
+		images.append({'height': int.from_bytes(b[i:i + 2], 'big'), 'url': f'{SPOTIFY_IMAGES}{b[i + 5:i + 5 + n].hex()}',
+						'width': int.from_bytes(b[i + 2:i + 4], 'big')})
+		i += 5 + n
+
+	return images
+
+def compact(artists):
+	"""
+	generator of ArtistRecords from artist dictionaries
+	"""
+	for rc in artists:
+		yield rc if isinstance(rc, ArtistRecord) else ArtistRecord.from_dict(rc)
+
+def as_dict(o):
+	"""
+	for json.dumps(.., default=as_dict) so that ArtistRecords are written like dictionaries
+	"""
+	if isinstance(o, ArtistRecord):
+		return o.to_dict()
+
+	raise TypeError(f'{type(o).__name__} is not JSON serializable')
@@ -0,0 +1,85 @@
+import time
+
+"""
+incremental refreshes: every enrichment stage records in each artist when it last fetched the artist from
+its source and whether that worked, like
+
+	rc['fetched'] = {'songkick': {'at': 1528000000.0, 'ok': True}, 'gigs': {'at': .., 'ok': False}, ..}
+
+and on a refresh the planner picks only the artists that were never fetched from the source, whose last fetch
+failed or is older than the freshness policy for the source
+"""
+
+# how long what we got from each source stays fresh, in seconds
+POLICY = {'songkick': 30*86400,
+			'gigs': 7*86400,
+			'soundcloud': 7*86400,
+			'facebook': 86400,
+			'twitter': 86400}
+
+def mark(rc, source, ok=True, at=None):
+	"""
+	record in artist rc that it was fetched from source just now (or at) and if that worked
+	"""
+	fetched = dict(rc.get('fetched') or {})
+	fetched[source] = {'at': at or time.time(), 'ok': ok}
+
+	rc['fetched'] = fetched
+
+def fetched_at(rc, source):
+	"""
+	returns (when, ok) for the last fetch of rc from source or None
+	"""
+	f = (rc.get('fetched') or {}).get(source, None)
+
+	return (f['at'], f['ok']) if f else None
+
+
+class RefreshPlanner:
+	"""
+	picks the artists a stage has to (re)fetch; policy overrides POLICY for some sources
+	"""
+	def __init__(self, policy=None, now=None):
+
+		self.policy = {**POLICY, **(policy or {})}
+		self.now = now
+
+	def why(self, rc, source):
+		"""
+		returns why rc needs fetching from source ('new', 'failed' or 'stale') or None if it doesn't
+		"""
+		f = fetched_at(rc, source)
+
+		if f is None:
+			return 'new'
+
+		at, ok = f
+
+		if not ok:
+			return 'failed'
+
+		if at < (self.now or time.time()) - self.policy[source]:
+			return 'stale'
+
+		return None
+
+	def plan(self, artists, source):
+		"""
+		returns the list of artists from artists that need fetching from source
+		"""
+		todo = []
+		counts = {'new': 0, 'failed': 0, 'stale': 0}
+		n = 0
+
+		for rc in artists:
+
+			n += 1
+			why = self.why(rc, source)
+
+			if why:
+				counts[why] += 1
+				todo.append(rc)
+
+		print(f'{source}: refreshing {len(todo)} of {n} artists ({counts["new"]} new, {counts["failed"]} failed before, {counts["stale"]} stale)')
+
+		return todo
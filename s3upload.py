@@ -0,0 +1,156 @@
+import gzip
+import json
+import queue
+import threading
+from record import as_dict
+
+class _MultipartWriter:
+	"""
+	binary file-like object sending whatever is written to it to S3 as parts of a multipart upload;
+	only one part is kept in memory at a time
+	"""
+	def __init__(self, client, bucket, key, part_size):
+
+		self.client = client
+		self.bucket = bucket
+		self.key = key
+		self.part_size = part_size
+
+		self._buf = bytearray()
+		self._parts = []
+		self._upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+	def write(self, b):
+
+		self._buf += b
+
+		if len(self._buf) >= self.part_size:
+			self._send()
+
+		return len(b)
+
+	def flush(self):
+		pass
+
+	def _send(self):
+
+		n = len(self._parts) + 1
+		r = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=n, Body=bytes(self._buf))
+
+		self._parts.append({'ETag': r['ETag'], 'PartNumber': n})
+		self._buf.clear()
+
+	def close(self):
+
+		# the last part may be smaller than the minimum part size (and there has to be at least one)
+		if self._buf or not self._parts:
+			self._send()
+
+		self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+												MultipartUpload={'Parts': self._parts})
+
+	def abort(self):
+
+		self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+
+
+class S3Uploader:
+	"""
+	upload JSON-serializable objects to S3 in the background: put() queues an upload and returns straight
+	away (unless max_queue uploads are already waiting), workers threads share one client and stream
+	every object as gzipped JSON in a multipart upload without building the whole payload in memory
+	"""
+	# S3 wants parts of at least 5MB
+	PART_SIZE = 8 << 20
+
+	def __init__(self, credentials, bucket='tega-uploads', prefix='Igor/temp/gigographies/', workers=2,
+					max_queue=4, compress=True, endpoint_url=None):
+
+		self.credentials = credentials
+		self.bucket = bucket
+		self.prefix = prefix
+		self.compress = compress
+		self.endpoint_url = endpoint_url
+
+		self.errors = []
+
+		self._client = None
+		self._client_lock = threading.Lock()
+		self._queue = queue.Queue(maxsize=max_queue)
+		self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+
+		for w in self._workers:
+			w.start()
+
+	@property
+	def client(self):
+		"""
+		one boto3 client for all uploads, created on first use
+		"""
+		with self._client_lock:
+			if self._client is None:
+				import boto3
+				self._client = boto3.client('s3', endpoint_url=self.endpoint_url, **self.credentials)
+
+		return self._client
+
+	def key(self, file_):
+
+		return f'{self.prefix}{file_}{".gz" if self.compress else ""}'
+
+	def upload(self, what, file_):
+		"""
+		upload what as JSON to file_ (under the prefix) right now; returns the key
+		"""
+		key = self.key(file_)
+		out = _MultipartWriter(self.client, self.bucket, key, S3Uploader.PART_SIZE)
+
+		try:
+			f = gzip.GzipFile(fileobj=out, mode='wb') if self.compress else out
+			buf = []
+			size = 0
+			# iterencode produces lots of tiny strings, write them some 64K at a time
+			for chunk in json.JSONEncoder(default=as_dict).iterencode(what):
+				buf.append(chunk)
+				size += len(chunk)
+				if size >= 1 << 16:
+					f.write(''.join(buf).encode())
+					buf = []
+					size = 0
+			f.write(''.join(buf).encode())
+			if self.compress:
+				f.close()
+			out.close()
+		except:
+			out.abort()
+			raise
+
+		return key
+
+	def put(self, what, file_):
+		"""
+		queue what for uploading to file_ (under the prefix)
+		"""
+		self._queue.put((what, file_))
+
+	def _work(self):
+
+		while True:
+
+			what, file_ = self._queue.get()
+
+			try:
+				self.upload(what, file_)
+			except Exception as e:
+				self.errors.append((file_, e))
+				print(f'can\'t upload {file_} to s3: {e}')
+			finally:
+				self._queue.task_done()
+
+	def join(self):
+		"""
+		wait until everything queued so far is uploaded; returns a list of (file, error) for failed uploads
+		"""
+		self._queue.join()
+
+		return self.errors
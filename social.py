@@ -0,0 +1,211 @@
+import asyncio
+import json
+import re
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from fetcher import AsyncFetcher, RateLimiter, map_ordered
+from metrics import REGISTRY as metrics, Progress
+from refresh import mark
+
+"""
+social metrics (Facebook likes and Twitter followers) for many artists at once: Facebook pages are fetched
+concurrently (with at most per_host requests to facebook.com in flight) and the likes counter is found by
+scanning the HTML for it rather than parsing the whole page; Twitter users are looked up 100 screen names
+per request while the Facebook pages are being fetched
+"""
+
+# <span id="PagesLikesCountDOMID">1,234,567 <span class="..">likes</span></span>
+_LIKES_RE = re.compile(r'<span[^>]*\bid="PagesLikesCountDOMID"[^>]*>(.*?)</span>', re.S)
+_TAG_RE = re.compile(r'<[^>]*>')
+
+_SCREEN_NAME_RE = re.compile(r'[A-Za-z0-9_]{1,15}')
+
+def facebook_likes(html):
+	"""
+	returns the number of likes on a Facebook page or None if the page doesn't say
+	"""
+	i = html.find('PagesLikesCountDOMID')
+
+	if i < 0:
+		return None
+
+	# the counter is somewhere right after the id so there's no need to scan the rest of the page
+	m = _LIKES_RE.search(html, max(0, html.rfind('<span', 0, i)), i + 1000)
+
+	if m is None:
+		return None
+
+	try:
+		return int(_TAG_RE.sub(' ', m.group(1)).strip().split()[0].replace(',', '').replace('.', ''))
+	except (IndexError, ValueError):
+		return None
+
+def screen_name(url):
+	"""
+	Twitter screen name (lower case) from a profile URL like https://mobile.twitter.com/@placebo?lang=en
+	or a screen name, None if there isn't one
+	"""
+	if not url:
+		return None
+
+	url = url.strip()
+
+	if '/' in url:
+		parts = urlsplit(url if '//' in url else f'//{url}')
+		# old profile links look like https://twitter.com/#!/placebo
+		path = parts.path if parts.path.strip('/') else parts.fragment.lstrip('!')
+		url = next((p for p in path.split('/') if p), '')
+
+	url = url.lstrip('@')
+
+	return url.lower() if _SCREEN_NAME_RE.fullmatch(url) else None
+
+
+class SocialRefresher:
+	"""
+	lookup is a function taking a list of at most BATCH screen names and returning a list of Twitter user
+	dictionaries (with screen_name and followers_count) for those that exist, see birdy_lookup
+	"""
+	BATCH = 100
+
+	def __init__(self, lookup=None, concurrency=20, per_host=4, twitter_workers=2, twitter_rate=1, retries=3, cache=None):
+
+		self.lookup = lookup
+		self.concurrency = concurrency
+		self.per_host = per_host
+		self.twitter_workers = twitter_workers
+		self.twitter_limiter = RateLimiter(twitter_rate)
+		self.retries = retries
+		self.cache = cache
+
+	async def _facebook(self, urls):
+
+		progress = Progress('facebook', len(urls))
+
+		async def _likes(url):
+			try:
+				return facebook_likes(await f.get_text(url))
+			finally:
+				progress.update()
+
+		async with AsyncFetcher(concurrency=self.concurrency, per_host=self.per_host, retries=self.retries,
+									cache=self.cache, source='facebook') as f:
+			res = await map_ordered(_likes, urls, self.concurrency)
+
+		progress.close()
+
+		return {url: r for url, r in zip(urls, res) if not isinstance(r, Exception)}
+
+	def facebook(self, urls):
+		"""
+		returns a dictionary {page URL: likes or None if the page doesn't say} for the pages in urls that
+		could be fetched
+		"""
+		return asyncio.run(self._facebook(list(urls)))
+
+	def _lookup_batch(self, names):
+
+		self.twitter_limiter.wait()
+
+		metrics.inc('requests', 'twitter')
+
+		try:
+			with metrics.timer('latency', 'twitter'):
+				users = self.lookup(names)
+		except Exception:
+			metrics.inc('errors', 'twitter')
+			raise
+
+		return {u['screen_name'].lower(): u['followers_count'] for u in users}
+
+	def twitter(self, names):
+		"""
+		returns a dictionary {screen name: followers or None if there's no such user} for the screen names in
+		names that could be looked up; names already in the cache aren't looked up again
+		"""
+		names = list(dict.fromkeys(n for n in names if n))
+		followers = {}
+		todo = []
+
+		for n in names:
+			body = self.cache.get('twitter', 'users/lookup', {'screen_name': n}) if self.cache is not None else None
+			if body is None:
+				todo.append(n)
+			else:
+				metrics.inc('cache_hits', 'twitter')
+				followers[n] = json.loads(body)
+
+		batches = [todo[i:i + SocialRefresher.BATCH] for i in range(0, len(todo), SocialRefresher.BATCH)]
+
+		with Progress('twitter', len(batches)) as progress, ThreadPoolExecutor(max_workers=self.twitter_workers) as pool:
+
+			for batch, fut in zip(batches, [pool.submit(self._lookup_batch, b) for b in batches]):
+
+				progress.update()
+
+				try:
+					found = fut.result()
+				except Exception as e:
+					print(f'can\'t look up {len(batch)} twitter users: {e}')
+					continue
+
+				for n in batch:
+					followers[n] = found.get(n, None)
+					# names that don't exist are cached too so that we don't keep asking
+					if self.cache is not None:
+						self.cache.set('twitter', 'users/lookup', {'screen_name': n}, json.dumps(followers[n]))
+
+		return followers
+
+	def refresh(self, facebook_artists=(), twitter_artists=()):
+		"""
+		add facebook_likes to facebook_artists and twitter_followers to twitter_artists (artists with Facebook
+		and Twitter links in their media) and record in every artist when it was fetched; Twitter lookups run
+		in background threads while the Facebook pages are fetched
+		"""
+		fb_urls = list(dict.fromkeys(rc['media']['facebook'] for rc in facebook_artists))
+		tw_names = list(dict.fromkeys(screen_name(rc['media']['twitter']) for rc in twitter_artists)) if self.lookup else []
+
+		with ThreadPoolExecutor(max_workers=1) as pool:
+
+			tw = pool.submit(self.twitter, tw_names)
+			likes = self.facebook(fb_urls) if fb_urls else {}
+			followers = tw.result()
+
+		for rc in facebook_artists:
+			self._update(rc, 'facebook', rc['media']['facebook'], likes, 'facebook_likes')
+
+		for rc in twitter_artists:
+			self._update(rc, 'twitter', screen_name(rc['media']['twitter']), followers, 'twitter_followers')
+
+	@staticmethod
+	def _update(rc, source, key_, found, field):
+
+		# like a Twitter link without a screen name in it
+		if key_ is None:
+			mark(rc, source)
+			metrics.inc('misses', source)
+			return
+
+		if key_ not in found:
+			mark(rc, source, ok=False)
+			return
+
+		mark(rc, source)
+
+		if found[key_] is None:
+			metrics.inc('misses', source)
+		else:
+			rc.update({field: found[key_]})
+			metrics.inc('matches', source)
+
+
+def birdy_lookup(credentials):
+	"""
+	users/lookup via a birdy UserClient with credentials (a dictionary of its arguments)
+	"""
+	from birdy.twitter import UserClient
+
+	client = UserClient(**credentials)
+
+	return lambda names: client.api.users.lookup.post(screen_name=','.join(names)).data
@@ -0,0 +1,203 @@
+import asyncio
+import json
+from checkpoint import Checkpoint
+from fetcher import AsyncFetcher, FetchError, RateLimiter, map_ordered
+from metrics import Progress
+
+SONGKICK_API = 'https://api.songkick.com/api/3.0'
+
+class SongkickResolver:
+	"""
+	search Songkick for many artist names concurrently; requests go through one pooled
+	keep-alive client and a token bucket so that we stay within the Songkick quota
+	"""
+	def __init__(self, api_key, concurrency=10, rate=5, retries=3, base_url=SONGKICK_API, cache=None):
+
+		self.api_key = api_key
+		self.cache = cache
+		self.concurrency = concurrency
+		self.rate_limiter = RateLimiter(rate)
+		self.retries = retries
+		self.base_url = base_url
+
+	async def search(self, fetcher, name):
+		"""
+		returns the top search result for name like {'name': 'Placebo', 'id_sk': 324967}
+		or {'name': None, 'id_sk': None} if there is nothing
+		"""
+		r = await fetcher.get_json(f'{self.base_url}/search/artists.json', params={'query': name, 'apikey': self.api_key})
+
+		try:
+			res = r["resultsPage"]["results"]["artist"][0]  # take the top search result
+		except:
+			return {'name': None, 'id_sk': None}
+
+		return {'name': res['displayName'], 'id_sk': res['id']}
+
+	async def resolve(self, names):
+		"""
+		search for all names; returns a list of search results in the same order as names,
+		failed requests come back as {'name': None, 'id_sk': None, 'error': 'what went wrong'}
+		"""
+		names = list(names)
+
+		async def _search(name):
+			try:
+				return await self.search(f, name)
+			finally:
+				progress.update()
+
+		with Progress('songkick_search', len(names)) as progress:
+			async with AsyncFetcher(concurrency=self.concurrency, rate_limiter=self.rate_limiter, retries=self.retries,
+										cache=self.cache, source='songkick_search') as f:
+				res = await map_ordered(_search, names, self.concurrency)
+
+		return [{'name': None, 'id_sk': None, 'error': str(r)} if isinstance(r, Exception) else r for r in res]
+
+	def resolve_many(self, names):
+
+		return asyncio.run(self.resolve(names))
+
+
+class GigCrawler:
+	"""
+	collect complete gigographies (all pages) from Songkick for many artists concurrently; finished
+	artists are handed over in batches of batch_size and only then written to the checkpoint journal,
+	so a restarted crawl continues where the last one stopped; artists whose requests keep failing
+	for reasons that may go away (no connection, 429, 5xx, see AsyncFetcher.RETRY_STATUS) are retried in up to retry_rounds more rounds
+	and whatever still fails ends up in retry_file; artists Songkick says it doesn't have (other 4xx)
+	are finished without gigs
+	"""
+	PER_PAGE = 50
+
+	def __init__(self, api_key, checkpoint_file, retry_file, concurrency=10, rate=5, retries=3,
+					retry_rounds=2, batch_size=5000, base_url=SONGKICK_API, cache=None):
+
+		self.api_key = api_key
+		self.cache = cache
+		self.checkpoint_file = checkpoint_file
+		self.retry_file = retry_file
+		self.concurrency = concurrency
+		self.rate_limiter = RateLimiter(rate)
+		self.retries = retries
+		self.retry_rounds = retry_rounds
+		self.batch_size = batch_size
+		self.base_url = base_url
+
+	async def gigography(self, fetcher, id_sk):
+		"""
+		returns a list of all events for artist id_sk; the first page says how many there are, the other
+		pages are then fetched concurrently
+		"""
+		url = f'{self.base_url}/artists/{id_sk}/gigography.json'
+		params = {'apikey': self.api_key, 'per_page': GigCrawler.PER_PAGE}
+
+		page = (await fetcher.get_json(url, params={**params, 'page': 1}))['resultsPage']
+
+		events = page.get('results', {}).get('event', [])
+
+		pages = -(-page.get('totalEntries', 0)//page.get('perPage', GigCrawler.PER_PAGE))
+
+		for r in await asyncio.gather(*[fetcher.get_json(url, params={**params, 'page': p}) for p in range(2, pages + 1)]):
+			events.extend(r['resultsPage'].get('results', {}).get('event', []))
+
+		return events
+
+	@staticmethod
+	def retryable(status):
+		"""
+		if a request that failed with HTTP status (None if there was no response) may work another time
+		"""
+		return (status is None) or (status in AsyncFetcher.RETRY_STATUS)
+
+	async def crawl(self, artists, on_batch=None):
+		"""
+		add gigs to every artist in artists that has a Songkick id and isn't in the checkpoint journal yet;
+		on_batch(batch, n) is called with each batch of finished artists, n is how many artists had been
+		done before this batch; it runs in a thread of its own (one batch at a time) so that slow dumps don't
+		hold up the requests in flight; returns a list of artists that failed
+		"""
+		batch = []
+		failed = []
+		permanent = []
+
+		with Checkpoint(self.checkpoint_file) as checkpoint:
+
+			flush_lock = asyncio.Lock()
+
+			async def _flush():
+
+				if not batch:
+					return
+
+				done = list(batch)
+				batch.clear()
+
+				# batches are handed over in order and only then go into the journal
+				async with flush_lock:
+					if on_batch:
+						await asyncio.to_thread(on_batch, done, len(checkpoint))
+					checkpoint.add_many(rc['id_sk'] for rc in done)
+
+			async def _crawl_artist(rc):
+
+				try:
+					gigs = await self.gigography(fetcher, rc['id_sk'])
+				except Exception as e:
+					status = e.status if isinstance(e, FetchError) else None
+					if GigCrawler.retryable(status):
+						failed.append({'name': rc['name'], 'id_sk': rc['id_sk'], 'status': status, 'error': str(e)})
+						return
+					# asking again won't help so the artist is done, without gigs
+					print(f'no gigography for {rc["name"]} (id {rc["id_sk"]}): {e}')
+					permanent.append({'name': rc['name'], 'id_sk': rc['id_sk'], 'status': status, 'error': str(e)})
+					gigs = None
+				finally:
+					progress.update()
+
+				if gigs:
+					rc.update({'gigs': gigs})
+
+				batch.append(rc)
+
+				if len(batch) >= self.batch_size:
+					await _flush()
+
+			todo = [rc for rc in artists if (rc.get('name') or '').strip() and rc.get('id_sk') and (rc['id_sk'] not in checkpoint)]
+
+			print(f'{len(checkpoint)} artists done before, {len(todo)} to go...')
+
+			progress = Progress('songkick_gigs', len(todo))
+
+			async with AsyncFetcher(concurrency=self.concurrency, rate_limiter=self.rate_limiter, retries=self.retries,
+										cache=self.cache, source='songkick_gigs') as fetcher:
+
+				for round_ in range(self.retry_rounds + 1):
+
+					await map_ordered(_crawl_artist, todo, self.concurrency)
+
+					if not failed:
+						break
+
+					# retry queue for the next round
+					retry_ids = {a['id_sk'] for a in failed}
+					todo = [rc for rc in todo if rc['id_sk'] in retry_ids]
+
+					if round_ < self.retry_rounds:
+						print(f'retrying {len(todo)} artists...')
+						progress.total += len(todo)
+						failed.clear()
+
+			await _flush()
+			progress.close()
+
+		with open(self.retry_file, 'w') as f:
+			json.dump(failed, f)
+
+		print(f'done. failed: {len(failed)} artists (see {self.retry_file}), {len(permanent)} artists not on Songkick')
+
+		return failed
+
+	def run(self, artists, on_batch=None):
+
+		return asyncio.run(self.crawl(artists, on_batch))
@@ -0,0 +1,104 @@
+import asyncio
+from functools import lru_cache
+from artistnormaliser import normalise_name
+from fetcher import AsyncFetcher, FetchError, RateLimiter, map_ordered
+from metrics import Progress
+
+SOUNDCLOUD_API = 'https://api.soundcloud.com'
+
+# SoundCloud user fields we keep and what they are called in an artist record
+FIELDS = (('country', 'country'), ('city', 'city'), ('followers_count', 'followers_soundcloud'),
+			('id', 'id_sc'), ('permalink_url', 'url_sc'), ('website', 'website'))
+
+def user_fields(user):
+	"""
+	the fields we keep from a SoundCloud user: numbers as they are, strings (longer than one character) in lower case
+	"""
+	fields = {}
+
+	for field_orig, field_new in FIELDS:
+
+		v = user.get(field_orig, None)
+
+		if isinstance(v, int):
+			fields[field_new] = v
+		elif isinstance(v, str) and (len(v) > 1):
+			fields[field_new] = v.lower()
+
+	return fields
+
+
+class SoundCloudResolver:
+	"""
+	find many artists on SoundCloud concurrently (at most concurrency requests in flight, no more than rate
+	per second); an artist with a known SoundCloud id is looked up directly, any other artist is searched for
+	and the first of the top results whose full name or user name normalizes to the artist name is the match
+	"""
+	def __init__(self, client_id, concurrency=10, rate=10, retries=3, top=5, base_url=SOUNDCLOUD_API, cache=None,
+					normaliser=normalise_name):
+
+		self.client_id = client_id
+		self.concurrency = concurrency
+		self.rate_limiter = RateLimiter(rate)
+		self.retries = retries
+		self.top = top
+		self.base_url = base_url
+		self.cache = cache
+		# the same names come up in many search results
+		self.normaliser = lru_cache(maxsize=1 << 17)(normaliser)
+
+	def match(self, name, users):
+		"""
+		returns the first user from users known as (normalized) name or None
+		"""
+		for u in users:
+			for c in ('full_name', 'username'):
+				if u.get(c) and (self.normaliser(u[c]) == name):
+					return u
+
+		return None
+
+	async def find(self, fetcher, rc):
+		"""
+		returns the SoundCloud user for artist rc or None if there's none
+		"""
+		if rc.get('id_sc'):
+			try:
+				return await fetcher.get_json(f'{self.base_url}/users/{rc["id_sc"]}', params={'client_id': self.client_id})
+			except FetchError as e:
+				# the id is no good any more so search for the name instead
+				if e.status != 404:
+					raise
+
+		users = await fetcher.get_json(f'{self.base_url}/users', params={'q': rc['name'], 'limit': self.top, 'client_id': self.client_id})
+
+		# newer versions of the API wrap results in a collection
+		if isinstance(users, dict):
+			users = users.get('collection', [])
+
+		return self.match(rc['name'], users[:self.top])
+
+	async def resolve(self, artists):
+		"""
+		returns a list with the SoundCloud user (or None) for every artist in artists, or an exception
+		where requests failed
+		"""
+		progress = Progress('soundcloud', len(artists))
+
+		async def _find(rc):
+			try:
+				return await self.find(f, rc)
+			finally:
+				progress.update()
+
+		async with AsyncFetcher(concurrency=self.concurrency, rate_limiter=self.rate_limiter, retries=self.retries,
+									cache=self.cache, source='soundcloud') as f:
+			res = await map_ordered(_find, artists, self.concurrency)
+
+		progress.close()
+
+		return res
+
+	def resolve_many(self, artists):
+
+		return asyncio.run(self.resolve(list(artists)))
@@ -0,0 +1,118 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from checkpoint import Checkpoint
+from fetcher import RateLimiter
+from metrics import REGISTRY as metrics, Progress
+from store import read_artists, append_artists
+
+class GenreCrawler:
+	"""
+	collect Spotify artists by searching for every genre; genres are searched concurrently by
+	workers threads sharing one rate limiter, paging through results stops as soon as a page comes back
+	short; new artists are appended to out_path as soon as a genre is done and the genre goes into
+	the checkpoint journal, so a restarted crawl skips the genres it already has
+	"""
+	PAGE = 50
+
+	def __init__(self, sp, out_path, checkpoint_file, workers=8, rate=10, max_results=4000):
+		"""
+		sp is a spotipy.Spotify client
+		"""
+		self.sp = sp
+		self.out_path = out_path
+		self.checkpoint_file = checkpoint_file
+		self.workers = workers
+		self.rate_limiter = RateLimiter(rate)
+		self.max_results = max_results
+
+		self.requests = 0
+		# genres that couldn't be collected in the last crawl
+		self.failed = []
+		self._lock = threading.Lock()
+
+	def genre_artists(self, genre):
+		"""
+		returns a list of all artists Spotify finds for genre
+		"""
+		artists = []
+
+		for offset in range(0, self.max_results, GenreCrawler.PAGE):
+
+			self.rate_limiter.wait()
+
+			metrics.inc('requests', 'spotify')
+
+			try:
+				with metrics.timer('latency', 'spotify'):
+					res = self.sp.search(q='genre:' + genre.replace(' ',''), type='artist', limit=GenreCrawler.PAGE, offset=offset)['artists']
+			except Exception:
+				metrics.inc('errors', 'spotify')
+				raise
+
+			with self._lock:
+				self.requests += 1
+
+			artists.extend(res['items'])
+
+			# no point asking for more
+			if (len(res['items']) < GenreCrawler.PAGE) or (offset + GenreCrawler.PAGE >= res.get('total', self.max_results)):
+				break
+
+		return artists
+
+	def crawl(self, genres, on_artists=None):
+		"""
+		search for artists in all genres not in the checkpoint journal yet; on_artists(artists) is called with
+		new artists from every finished genre; returns how many new artists were found
+		"""
+		# artists collected by earlier runs
+		artist_ids = {rc['id'] for rc in read_artists(self.out_path)} if os.path.exists(self.out_path) else set()
+
+		n = 0
+		self.failed = []
+
+		with Checkpoint(self.checkpoint_file) as checkpoint, ThreadPoolExecutor(max_workers=self.workers) as pool:
+
+			todo = [g for g in genres if g not in checkpoint]
+
+			print(f'{len(checkpoint)} genres done before, {len(todo)} to go...')
+
+			futures = {pool.submit(self.genre_artists, g): g for g in todo}
+			progress = Progress('spotify_genres', len(todo))
+
+			for fut in as_completed(futures):
+
+				g = futures[fut]
+				progress.update()
+
+				try:
+					found = fut.result()
+				except Exception as e:
+					print(f'can\'t collect genre {g}: {e}')
+					self.failed.append(g)
+					continue
+
+				new_ = []
+
+				for a in found:
+					# note that a is a dictionary with artist information
+					if len(a["name"]) == len(a["name"].encode()):   # don't allow Chinese symbols
+						if a['id'] not in artist_ids:
+							artist_ids.add(a['id'])
+							new_.append(a)
+
+				append_artists(self.out_path, new_)
+				checkpoint.add(g)
+
+				if on_artists:
+					on_artists(new_)
+
+				n += len(new_)
+				metrics.inc('new_artists', 'spotify', len(new_))
+
+			progress.close()
+
+		print(f'collected {n} artists with {self.requests} requests' + (f', {len(self.failed)} genres failed' if self.failed else ''))
+
+		return n
@@ -0,0 +1,306 @@
+import gzip
+import json
+import os
+import re
+import sqlite3
+from artistnormaliser import normalise_name
+from record import as_dict
+
+"""
+artist files: one JSON document per line (.jsonl), gzip compressed if the file name ends with .gz;
+old files with all artists in a single JSON list (.json) can still be read and written
+"""
+
+# what may come between the items of a JSON list
+_SEPARATOR_RE = re.compile(r'[\s,]*')
+
+def _open(path, mode):
+
+	if path.endswith('.gz'):
+		return gzip.open(path, mode + 't', encoding='utf-8')
+
+	return open(path, mode, encoding='utf-8')
+
+def _iter_json_list(f, chunk_size=1 << 20):
+	"""
+	generator of the items of a JSON list in text file f; reads chunk_size characters at a time
+	so that even huge old-style files don't have to be loaded whole
+	"""
+	decoder = json.JSONDecoder()
+
+	buf = ''
+	pos = 0
+	started = False
+
+	while True:
+
+		pos = _SEPARATOR_RE.match(buf, pos).end()
+
+		if pos < len(buf):
+
+			if not started:
+				if buf[pos] != '[':
+					raise ValueError(f'{f.name} doesn\'t contain a JSON list!')
+				started = True
+				pos += 1
+				continue
+
+			if buf[pos] == ']':
+				return
+
+			try:
+				rc, pos = decoder.raw_decode(buf, pos)
+			except json.JSONDecodeError:
+				# most likely the item continues in the next chunk
+				pass
+			else:
+				yield rc
+				continue
+
+		more = f.read(chunk_size)
+
+		if not more:
+			if pos < len(buf):
+				raise ValueError(f'can\'t parse {f.name} at {buf[pos:pos + 50]!r}')
+			return
+
+		buf = buf[pos:] + more
+		pos = 0
+
+def is_jsonl(path):
+
+	return path.endswith('.jsonl') or path.endswith('.jsonl.gz')
+
+def read_artists(path):
+	"""
+	generator of artist dictionaries from path, line-delimited or a single JSON list
+	"""
+	with _open(path, 'r') as f:
+
+		# a single JSON list starts with [ and a line with an artist starts with {
+		first = f.read(1)
+		while first.isspace():
+			first = f.read(1)
+		f.seek(0)
+
+		if first == '[':
+			yield from _iter_json_list(f)
+		else:
+			for l in f:
+				if l.strip():
+					yield json.loads(l)
+
+
+class ArtistWriter:
+	"""
+	write artists to path one at a time; .jsonl files get one artist per line, other files get a single
+	JSON list; everything goes to a temporary file first which replaces path on close, so a crash
+	never leaves a half written artist file
+	"""
+	def __init__(self, path):
+
+		self.path = path
+		self.tmp_path = f'{path}.part'
+		self.count = 0
+
+		self._lines = is_jsonl(path)
+		self._f = gzip.open(self.tmp_path, 'wt', encoding='utf-8') if path.endswith('.gz') else open(self.tmp_path, 'w', encoding='utf-8')
+
+		if not self._lines:
+			self._f.write('[')
+
+	def write(self, rc):
+
+		if self._lines:
+			self._f.write(json.dumps(rc, default=as_dict))
+			self._f.write('\n')
+		else:
+			self._f.write(', ' if self.count else '')
+			self._f.write(json.dumps(rc, default=as_dict))
+
+		self.count += 1
+
+	def write_many(self, artists):
+
+		for rc in artists:
+			self.write(rc)
+
+		return self
+
+	def close(self):
+
+		if not self._lines:
+			self._f.write(']')
+
+		self._f.close()
+		os.replace(self.tmp_path, self.path)
+
+	def abort(self):
+
+		self._f.close()
+		os.remove(self.tmp_path)
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, exc_type, *exc):
+
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+
+def write_artists(path, artists):
+	"""
+	write artists (any iterable, it's consumed once) to path and return how many were written
+	"""
+	with ArtistWriter(path) as w:
+		w.write_many(artists)
+
+	return w.count
+
+def append_artists(path, artists):
+	"""
+	append artists to line-delimited file path (a compressed file simply gets another gzip member);
+	returns how many were written
+	"""
+	if not is_jsonl(path):
+		raise ValueError(f'can only append to .jsonl files, not {path}!')
+
+	n = 0
+
+	with _open(path, 'a') as f:
+		for rc in artists:
+			f.write(json.dumps(rc, default=as_dict))
+			f.write('\n')
+			n += 1
+
+	return n
+
+
+class ArtistDB:
+	"""
+	artists in a SQLite database, one row per artist keyed by the Spotify id; apart from the whole
+	artist dictionary (as JSON) every row keeps the name and the Songkick, SoundCloud and Discogs ids
+	in indexed columns so that point lookups don't need to scan anything;
+
+	the artists are expected to have gone through the normalize stage already, so their names are indexed
+	as they are - normalise_name isn't idempotent and running it again would change some of them;
+	normaliser is only for the names looked up with find_by_name
+	"""
+	# source id columns, named after the artist dictionary keys
+	ID_FIELDS = 'id_sk id_sc id_dg'.split()
+
+	def __init__(self, path, normaliser=normalise_name):
+
+		self.path = path
+		self.normaliser = normaliser
+
+		# updates may come from a background thread (like the gig crawl's batch dumps), one at a time
+		self.conn = sqlite3.connect(path, check_same_thread=False)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.execute('PRAGMA synchronous=NORMAL')
+
+		with self.conn:
+			self.conn.execute('''CREATE TABLE IF NOT EXISTS artists (id TEXT PRIMARY KEY, name TEXT, name_norm TEXT,
+									popularity INTEGER, id_sk, id_sc, id_dg, data TEXT NOT NULL)''')
+			for c in ['name_norm'] + ArtistDB.ID_FIELDS:
+				self.conn.execute(f'CREATE INDEX IF NOT EXISTS artists_{c} ON artists ({c})')
+
+	def _row(self, rc):
+
+		return (rc['id'], rc.get('name'), rc.get('name'), rc.get('popularity'),
+					*[rc.get(c) for c in ArtistDB.ID_FIELDS], json.dumps(rc, default=as_dict))
+
+	def upsert_many(self, artists, batch_size=10000):
+		"""
+		insert artists (any iterable of artist dictionaries with an id) or replace those already there;
+		returns how many artists were written
+		"""
+		sql = f'''INSERT INTO artists VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET name=excluded.name,
+					name_norm=excluded.name_norm, popularity=excluded.popularity, id_sk=excluded.id_sk,
+					id_sc=excluded.id_sc, id_dg=excluded.id_dg, data=excluded.data'''
+		n = 0
+		batch = []
+
+		for rc in artists:
+
+			batch.append(self._row(rc))
+
+			if len(batch) == batch_size:
+				with self.conn:
+					self.conn.executemany(sql, batch)
+				n += len(batch)
+				batch = []
+
+		with self.conn:
+			self.conn.executemany(sql, batch)
+
+		return n + len(batch)
+
+	def update_many(self, updates):
+		"""
+		update some fields of artists that are already in the database; updates is an iterable of pairs
+		like (artist id, {'id_sk': 324967}) - the new fields are merged into what's there
+		"""
+		sql = f'''UPDATE artists SET data=json_patch(data, ?1), {', '.join(f"{c}=coalesce(json_extract(?1, '$.{c}'), {c})" for c in ArtistDB.ID_FIELDS)}
+					WHERE id=?2'''
+
+		with self.conn:
+			return self.conn.executemany(sql, ((json.dumps(fields), id_) for id_, fields in updates)).rowcount
+
+	def delete_many(self, ids):
+
+		with self.conn:
+			return self.conn.executemany('DELETE FROM artists WHERE id=?', ((id_,) for id_ in ids)).rowcount
+
+	def get(self, id_):
+		"""
+		returns the artist with Spotify id id_ or None
+		"""
+		r = self.conn.execute('SELECT data FROM artists WHERE id=?', (id_,)).fetchone()
+
+		return json.loads(r[0]) if r else None
+
+	def find_by_name(self, name, normalized=False):
+		"""
+		returns a list of artists with this name, normalized once here unless normalized is True (like
+		a name taken from an artist record)
+		"""
+		return [json.loads(r[0]) for r in self.conn.execute('SELECT data FROM artists WHERE name_norm=?',
+																(name if normalized else self.normaliser(name),))]
+
+	def find_by_id(self, field, id_):
+		"""
+		returns a list of artists with a source id, e.g. find_by_id('id_sk', 324967)
+		"""
+		if field not in ArtistDB.ID_FIELDS:
+			raise ValueError(f'{field} isn\'t one of {ArtistDB.ID_FIELDS}!')
+
+		return [json.loads(r[0]) for r in self.conn.execute(f'SELECT data FROM artists WHERE {field}=?', (id_,))]
+
+	def ids(self):
+
+		return [r[0] for r in self.conn.execute('SELECT id FROM artists')]
+
+	def __len__(self):
+
+		return self.conn.execute('SELECT count(*) FROM artists').fetchone()[0]
+
+	def __iter__(self):
+
+		for r in self.conn.execute('SELECT data FROM artists ORDER BY rowid'):
+			yield json.loads(r[0])
+
+	def close(self):
+
+		self.conn.close()
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, *exc):
+
+		self.close()